@@ -2,9 +2,9 @@ from abc import ABC, abstractmethod
 from ReportParsers import Transaction
 import re
 from datetime import date
-from typing import List, Tuple, Union
+from typing import Iterator, List, Optional, Set, Tuple, Union
 from enum import Enum
-from TransactionTransformers import is_new_transaction
+from TransactionTransformers import transaction_key
 
 
 class FlowDirection(Enum):
@@ -13,40 +13,48 @@ class FlowDirection(Enum):
     NEUTRAL = "neutral"
 
 
+MatchDate = Optional[Union[date, Tuple[date, date]]]
+MatchArg = Tuple[re.Pattern, MatchDate]
+
+
 def match_receiver_and_date(
     pattern: re.Pattern, match_date: Union[date, Tuple[date]], transaction: Transaction
 ) -> bool:
-    result = pattern.search(transaction.receiver)
+    # The date check is cheaper than the regex search, so it goes first
     if match_date is None:
-        return result
+        return pattern.search(transaction.receiver)
     if isinstance(match_date, tuple):
         assert len(match_date) == 2
-        return (
-            result
-            and transaction.date >= match_date[0]
-            and transaction.date <= match_date[1]
-        )
+        if transaction.date < match_date[0] or transaction.date > match_date[1]:
+            return None
     elif isinstance(match_date, date):
-        return result and transaction.date == match_date
+        if transaction.date != match_date:
+            return None
     else:
         raise ValueError(
             f"Unexpected type of match_date {match_date}, {type(match_date)}"
         )
+    return pattern.search(transaction.receiver)
 
 
 class Category(ABC):
     def __init__(self, name: str):
         self._name = name
         self._transactions: List[Transaction] = []
+        self._keys: Set[tuple] = set()
         self._total: float = 0.0
 
     def get_name(self) -> str:
         return self._name
 
-    def add_transaction(self, transaction: Transaction) -> None:
-        if is_new_transaction(self._transactions, transaction):
-            self._transactions.append(transaction)
-            self._total += transaction.amount
+    def add_transaction(self, transaction: Transaction) -> bool:
+        key = transaction_key(transaction)
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        self._transactions.append(transaction)
+        self._total += transaction.amount
+        return True
 
     def add_transactions(self, transactions: List[Transaction]) -> None:
         for tx in transactions:
@@ -56,16 +64,25 @@ class Category(ABC):
         return self._total
 
     def get_transactions(self) -> List[Transaction]:
-        self._transactions.sort()
+        self._transactions.sort(key=Transaction.sort_key)
         return self._transactions
 
+    def iter_transactions(self) -> Iterator[Transaction]:
+        """The transactions in insertion order, without sorting them."""
+        return iter(self._transactions)
+
     def clear(self) -> None:
         self._transactions.clear()
+        self._keys.clear()
         self._total = 0.0
 
-    @abstractmethod
+    def get_match_args(self) -> List[MatchArg]:
+        return []
+
     def is_matched(self, transaction: Transaction) -> bool:
-        pass
+        return any(
+            match_receiver_and_date(p, d, transaction) for p, d in self.get_match_args()
+        )
 
     @abstractmethod
     def get_flow_direction(self) -> FlowDirection:
@@ -76,7 +93,7 @@ class Groceries(Category):
     def __init__(self):
         super().__init__("Groceries")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^(bck\*)?jumbo"),
             re.compile(r"^(bck\*)?kiosk"),
@@ -103,7 +120,7 @@ class Groceries(Category):
             re.compile(r"^chocoladefabriken lind", re.IGNORECASE),
             re.compile(r"^f\.h\.w\. gastronomie gmb$", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -113,7 +130,7 @@ class Transport(Category):
     def __init__(self):
         super().__init__("Transport")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^nlov[a-z0-9]{14}", re.IGNORECASE),
             re.compile(r"^uber$", re.IGNORECASE),
@@ -136,7 +153,7 @@ class Transport(Category):
             re.compile(r"^charter$", re.IGNORECASE),
             re.compile(r"^azerbaijan airlines$", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -146,13 +163,13 @@ class Insurance(Category):
     def __init__(self):
         super().__init__("Insurance")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^abn amro schadev nv$"),
             re.compile(r"^zilveren kruis\s"),
             re.compile(r"^allianz\s"),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -162,7 +179,7 @@ class HouseholdGoods(Category):
     def __init__(self):
         super().__init__("Household goods")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         match_args = [
             (re.compile(r"^amazon\b"), None),
             (re.compile(r"^ikea bv$"), None),
@@ -190,7 +207,7 @@ class HouseholdGoods(Category):
             (re.compile(r"^aircotech klimaattechniek", re.IGNORECASE), None),
             (re.compile(r"^downtown souvenirs$", re.IGNORECASE), None),
         ]
-        return any(match_receiver_and_date(p, d, transaction) for p, d in match_args)
+        return match_args
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -200,7 +217,7 @@ class Restaurants(Category):
     def __init__(self):
         super().__init__("Restaurants")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^de cafe new babylon$"),
             re.compile(r"^coffee district"),
@@ -273,7 +290,7 @@ class Restaurants(Category):
             re.compile(r"^bavaria berlin$", re.IGNORECASE),
             re.compile(r"^coffeecom\.\s*-\s*albron$", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -283,7 +300,7 @@ class Gina(Category):
     def __init__(self):
         super().__init__("Gina")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^pp_amsterdam$"),
             re.compile(r"^zooplus\s"),
@@ -291,7 +308,7 @@ class Gina(Category):
             re.compile(r"^(ccv\*)?dier van nu$"),
             re.compile(r"^veterfina", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -301,7 +318,7 @@ class Health(Category):
     def __init__(self):
         super().__init__("Health")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^etos\s+[a-z0-9\.]+", re.IGNORECASE),
             re.compile(r"^holland\s*(?:&\s*)?barrett$", re.IGNORECASE),
@@ -326,7 +343,7 @@ class Health(Category):
             re.compile(r"^plein\.nl\b", re.IGNORECASE),
             re.compile(r"^coders course$", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -336,7 +353,7 @@ class Clothes(Category):
     def __init__(self):
         super().__init__("Clothes")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^shein\.com$", re.IGNORECASE),
             re.compile(r"^schiesser\s", re.IGNORECASE),
@@ -353,7 +370,7 @@ class Clothes(Category):
             re.compile(r"^dilling a\.s$", re.IGNORECASE),
             re.compile(r"^zipster\b", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -363,7 +380,7 @@ class Child(Category):
     def __init__(self):
         super().__init__("Child")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^baby-dump b\.?v\.?$"),
             re.compile(r"^babywinkel b\.v\."),
@@ -383,7 +400,7 @@ class Child(Category):
             re.compile(r"^sociale verzekeringsbank$", re.IGNORECASE),
             re.compile(r"^transfer to booktell limited$", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -393,13 +410,13 @@ class Entertainment(Category):
     def __init__(self):
         super().__init__("Entertainment")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^llc karta travel$", re.IGNORECASE),
             re.compile(r"^sagrada família$", re.IGNORECASE),
             re.compile(r"^the upside down\b", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -409,7 +426,7 @@ class Hotels(Category):
     def __init__(self):
         super().__init__("Hotels")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^residence inn the hagu", re.IGNORECASE),
             re.compile(r"\bbooking\b", re.IGNORECASE),
@@ -418,7 +435,7 @@ class Hotels(Category):
             re.compile(r"^ibis$", re.IGNORECASE),
             re.compile(r"\bbabylonhoteldenha$", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -428,14 +445,14 @@ class Taxes(Category):
     def __init__(self):
         super().__init__("Taxes")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^immigratie en naturalisatie dienst$"),
             re.compile(r"^gemeente\s"),
             re.compile(r"belasting"),
             re.compile(r"\bgem(?:eente)?\s*den haag\b", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -445,7 +462,7 @@ class Documents(Category):
     def __init__(self):
         super().__init__("Documents")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^publiekszaken$"),
             re.compile(r"^lvov a\.m\.\s"),
@@ -454,7 +471,7 @@ class Documents(Category):
             re.compile(r"^department of home affairs$", re.IGNORECASE),
             re.compile(r"\bconsulate office\b", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -464,12 +481,12 @@ class VVE(Category):
     def __init__(self):
         super().__init__("VVE")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^vve la fenetre$"),
             re.compile(r"^vereniging van eigenaars la fen"),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -479,7 +496,7 @@ class Bills(Category):
     def __init__(self):
         super().__init__("Bills")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^odido netherlands b.v.$"),
             re.compile(r"^ziggo services bv$"),
@@ -487,7 +504,7 @@ class Bills(Category):
             re.compile(r"^magticom$"),
             re.compile(r"^dunea duin\b"),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -497,13 +514,13 @@ class Banks(Category):
     def __init__(self):
         super().__init__("Banks")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^abn amro bank n.v.$"),
             re.compile(r"^kosten tweede rekeninghouder$"),
             re.compile(r"^kosten oranjepakket$"),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -513,7 +530,7 @@ class InternalTransfers(Category):
     def __init__(self):
         super().__init__("InternalTransfers")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^safe net$"),
             re.compile(r"^d\.? krymova$"),
@@ -533,7 +550,7 @@ class InternalTransfers(Category):
             re.compile(r"^andrii lakatosh$", re.IGNORECASE),
             re.compile(r"^daria krymova$", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.NEUTRAL
@@ -543,12 +560,12 @@ class Apartment(Category):
     def __init__(self):
         super().__init__("Apartment")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^ing hypotheken$"),
             re.compile(r"^teilingen residence b\.v\.$"),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -558,11 +575,11 @@ class Income(Category):
     def __init__(self):
         super().__init__("Income")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^imc trading bv$"),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EARNINGS
@@ -572,7 +589,7 @@ class Services(Category):
     def __init__(self):
         super().__init__("Services")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
         patterns = [
             re.compile(r"^azarova consulting$"),
             re.compile(r"^openai$"),
@@ -589,7 +606,7 @@ class Services(Category):
             re.compile(r"^squarespace$", re.IGNORECASE),
             re.compile(r"^notion$", re.IGNORECASE),
         ]
-        return any(p.search(transaction.receiver) for p in patterns)
+        return [(p, None) for p in patterns]
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -599,7 +616,7 @@ class Others(Category):
     def __init__(self):
         super().__init__("Others")
 
-    def is_matched(self, transaction: Transaction) -> bool:
+    def get_match_args(self) -> List[MatchArg]:
 
         match_args = [
             (re.compile(r"^(ccv\*)?kroonenberg groep$"), None),
@@ -657,7 +674,7 @@ class Others(Category):
             (re.compile(r"^velicico\b", re.IGNORECASE), None),
             (re.compile(r"^герц$", re.IGNORECASE), None),
         ]
-        return any(match_receiver_and_date(p, d, transaction) for p, d in match_args)
+        return match_args
 
     def get_flow_direction(self):
         return FlowDirection.EXPENSES
@@ -674,3 +691,18 @@ class Ungrouped(Category):
 
     def get_flow_direction(self) -> FlowDirection:
         return FlowDirection.EXPENSES
+
+
+class RuleCategory(Category):
+    def __init__(
+        self, name: str, flow_direction: FlowDirection, match_args: List[MatchArg]
+    ):
+        super().__init__(name)
+        self._flow_direction = flow_direction
+        self._match_args = match_args
+
+    def get_match_args(self) -> List[MatchArg]:
+        return self._match_args
+
+    def get_flow_direction(self) -> FlowDirection:
+        return self._flow_direction
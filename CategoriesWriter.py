@@ -1,26 +1,133 @@
+import io
 import os
 import logging
-import shutil
 from abc import ABC, abstractmethod
-from GroupedTransactions import GroupedTransactions
+from itertools import groupby
+from typing import Iterable, List, Optional, Tuple
+from GroupedTransactions import (
+    GroupedTransactions,
+    is_compressed,
+    open_db,
+    read_manifest,
+    shard_month,
+    shard_path,
+    summarize_shard,
+    write_manifest,
+    write_rows,
+)
+from ReportParsers import Transaction
+from Constants import DB_BACKUP_GENERATIONS
+from Snapshots import SnapshotManager
 
 logger = logging.getLogger(__name__)
 
+WRITE_BUFFER_SIZE = 1 << 20
+
 
 class CategoriesSaver(ABC):
+    def __init__(self, generations: int = DB_BACKUP_GENERATIONS):
+        self._generations = generations
+
     @abstractmethod
     def save(self, grouped: GroupedTransactions, path: str) -> None:
         pass
 
+    @abstractmethod
+    def save_rows(self, rows: Iterable[Tuple[str, Transaction]], path: str) -> int:
+        """
+        Saves (category, transaction) rows that are already in canonical order
+        and returns how many were written.
+        """
+        pass
+
+    def _replace(self, tmp_path: str, path: str) -> None:
+        # The previous file becomes a backup by rename, no bytes are copied
+        SnapshotManager(path, self._generations).rotate()
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote grouped transactions to {path}")
+
+
+def _row_month(row: Tuple[str, Transaction]) -> str:
+    return shard_month(row[1].date)
+
 
 class CsvCategoriesSaver(CategoriesSaver):
+    """
+    Saves to a single CSV file, or to a partitioned database when path is a
+    directory. In a partitioned database only the month shards present in the
+    saved rows are considered, and of those only shards whose content changed
+    are rewritten. compress selects gzip storage; by default the format
+    already on disk is kept and new databases are stored uncompressed.
+    """
+
+    def __init__(
+        self,
+        compress: Optional[bool] = None,
+        generations: int = DB_BACKUP_GENERATIONS,
+    ):
+        super().__init__(generations)
+        self._compress = compress
+
     def save(self, grouped: GroupedTransactions, path: str, delimiter: str) -> None:
-        if os.path.exists(path):
-            backup_path = path + ".backup"
-            shutil.copy2(path, backup_path)
-            logger.warning(f"Existing file backed up to {backup_path}")
-
-        csv_text = grouped.serialize(delimiter=delimiter)
-        with open(path, mode="w", encoding="utf-8") as f:
-            f.write(csv_text)
-        logger.info(f"Wrote grouped transactions to {path}")
+        if os.path.isdir(path):
+            rows = sorted(grouped.iter_rows(), key=_row_month)  # stable
+            self._save_shards(rows, path, delimiter)
+        else:
+            self.save_rows(grouped.iter_rows(), path, delimiter)
+
+    def save_rows(
+        self, rows: Iterable[Tuple[str, Transaction]], path: str, delimiter: str
+    ) -> int:
+        """For a partitioned database the rows must also be grouped by month."""
+        if os.path.isdir(path):
+            return self._save_shards(rows, path, delimiter)
+        compress = self._compress
+        if compress is None:
+            compress = is_compressed(path)
+        tmp_path = path + ".tmp"
+        with open_db(
+            tmp_path, mode="w", compress=compress, buffering=WRITE_BUFFER_SIZE
+        ) as f:
+            row_count = write_rows(f, rows, delimiter=delimiter)
+        self._replace(tmp_path, path)
+        return row_count
+
+    def _save_shards(
+        self, rows: Iterable[Tuple[str, Transaction]], root: str, delimiter: str
+    ) -> int:
+        manifest = read_manifest(root)
+        compress = self._compress
+        if compress is None:
+            compress = any(shard.get("compressed") for shard in manifest.values())
+        seen = set()
+        row_count = 0
+        changed = False
+        for month, month_rows in groupby(rows, key=_row_month):
+            if month in seen:
+                raise ValueError(f"Rows of {month} are not grouped by month")
+            seen.add(month)
+            shard_rows: List[Tuple[str, Transaction]] = list(month_rows)
+            row_count += len(shard_rows)
+            out = io.StringIO()
+            write_rows(out, shard_rows, delimiter=delimiter)
+            content = out.getvalue()
+            summary = summarize_shard(shard_rows, content)
+            summary["compressed"] = compress
+            old = manifest.get(month, {})
+            if (
+                old.get("sha256") == summary["sha256"]
+                and old.get("compressed", False) == compress
+            ):
+                continue
+            if not changed:
+                # Unchanged shards are shared with the snapshot by hard links
+                SnapshotManager(root, self._generations).snapshot()
+                changed = True
+            path = shard_path(root, month)
+            with open_db(path + ".tmp", mode="w", compress=compress) as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+            manifest[month] = summary
+        if changed:
+            write_manifest(root, manifest)
+        return row_count
@@ -1,2 +1,11 @@
 GROUPED_CATEGORIES_CSV_PATH = "grouped_categories.csv"
 DEFAULT_CSV_DELIMITER = "|"
+CATEGORY_RULES_PATH = "category_rules.json"
+DEFAULT_SHOW_MONTHS = 12
+RENDER_DPI = 90
+STATISTICS_IMAGE_FORMAT = "png"
+INGEST_JOBS_DIR = "ingest_jobs"
+INGEST_JOB_RETENTION_DAYS = 7
+INGEST_UPLOAD_TTL_HOURS = 24
+STATEMENT_LEDGER_PATH = "statement_ledger.json"
+DB_BACKUP_GENERATIONS = 5
@@ -1,53 +1,93 @@
 import matplotlib.pyplot as plt
-from typing import List, Dict
+from typing import List, Dict, Iterable, Optional, Tuple
 from collections import defaultdict
-from Categories import Category, FlowDirection, Ungrouped
+from datetime import date
+from Categories import Category, FlowDirection
 from GroupedTransactions import GroupedTransactions
+from ReportParsers import Transaction
+from TransactionQuery import TransactionQuery, TransactionFilter, month_window_start
 import logging
+import threading
+from io import BytesIO
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
 from matplotlib.figure import Figure
-import copy
-
+from matplotlib.patches import Patch
+from matplotlib.transforms import offset_copy
+from PIL import Image
+from Constants import RENDER_DPI
 
 logger = logging.getLogger(__name__)
 
 
 class ExpenseVisualizer:
-    def __init__(self, categories: List[Category]):
-        self.categories = self._filter_categories(copy.deepcopy(categories))
+    def __init__(
+        self,
+        categories: List[Category],
+        entries: Optional[Iterable[Tuple[str, Transaction]]] = None,
+        scope: str = "",
+    ):
+        self.flow_directions: Dict[str, FlowDirection] = {
+            c.get_name(): c.get_flow_direction() for c in categories
+        }
+        self.scope = scope
         self.expense_monthly_data: Dict[str, Dict[str, float]] = defaultdict(
             lambda: defaultdict(float)
         )
         self.earnings_monthly_data: Dict[str, Dict[str, float]] = defaultdict(
             lambda: defaultdict(float)
         )
+        if entries is None:
+            entries = (
+                (c.get_name(), tx) for c in categories for tx in c.get_transactions()
+            )
         logger.info("Initializing ExpenseVisualizer and computing monthly totals...")
-        self._compute_monthly_totals()
-
-    def _filter_categories(self, categories: List[Category]) -> List[Category]:
-        for cat in categories:
-            if cat.get_name() == "Ungrouped":
-                neg_only = [tx for tx in cat.get_transactions() if tx.amount <= 0]
-                if len(neg_only) < len(cat.get_transactions()):
-                    logger.warning(
-                        f"Found {len(cat.get_transactions()) - len(neg_only)}"
-                        " earning ungrouped transactions. "
-                        "Will ignore them when building statistics"
-                    )
-                    cat.clear()
-                    cat.add_transactions(neg_only)
-        return categories
-
-    def _compute_monthly_totals(self):
+        self._compute_monthly_totals(entries)
+
+    @classmethod
+    def from_grouped(
+        cls,
+        gt: GroupedTransactions,
+        sender: Optional[str] = None,
+        last_months: Optional[int] = None,
+    ) -> "ExpenseVisualizer":
+        start = None
+        scope = [sender] if sender else []
+        if last_months is not None:
+            start = month_window_start(date.today(), last_months)
+            scope.append(f"last {last_months} months")
+        entries = None
+        if sender is not None or start is not None:
+            entries = TransactionQuery(gt).entries(
+                TransactionFilter(sender=sender, start=start)
+            )
+        return cls(gt.get_categories(), entries, scope=", ".join(scope))
+
+    @classmethod
+    def from_monthly_data(
+        cls,
+        expenses: Dict[str, Dict[str, float]],
+        earnings: Dict[str, Dict[str, float]],
+        scope: str = "",
+    ) -> "ExpenseVisualizer":
+        """Rebuilds a visualizer from monthly totals computed elsewhere."""
+        visualizer = cls([], entries=(), scope=scope)
+        for cat, months in expenses.items():
+            visualizer.expense_monthly_data[cat].update(months)
+        for cat, months in earnings.items():
+            visualizer.earnings_monthly_data[cat].update(months)
+        return visualizer
+
+    def _compute_monthly_totals(self, entries: Iterable[Tuple[str, Transaction]]):
         skipped = 0
-        for category in self.categories:
-            name = category.get_name()
-            txs = category.get_transactions()
-            logger.debug(f"Processing {len(txs)} transactions for category: {name}")
-            monthly_data = None
-            flow_direction = category.get_flow_direction()
+        ungrouped_earnings = 0
+        for name, tx in entries:
+            flow_direction = self.flow_directions[name]
             if flow_direction == FlowDirection.NEUTRAL:
-                skipped += len(txs)
-                monthly_data = None
+                skipped += 1
+                continue
+            elif name == "Ungrouped" and tx.amount > 0:
+                ungrouped_earnings += 1
                 continue
             elif flow_direction == FlowDirection.EARNINGS:
                 monthly_data = self.earnings_monthly_data[name]
@@ -56,10 +96,13 @@ class ExpenseVisualizer:
             else:
                 raise ValueError(f"Unknown flow_direction {flow_direction}")
 
-            for tx in txs:
-                month = tx.date.strftime("%Y-%m")
-                monthly_data[month] += tx.amount
-        logger.info(f"Skipped {skipped} category(ies) named 'InternalTransfers'")
+            monthly_data[tx.date.strftime("%Y-%m")] += tx.amount
+        if ungrouped_earnings:
+            logger.warning(
+                f"Found {ungrouped_earnings} earning ungrouped transactions. "
+                "Will ignore them when building statistics"
+            )
+        logger.info(f"Skipped {skipped} transaction(s) of neutral categories")
 
     def _filter_categories_by_threshold(
         self, min_percentage: float
@@ -110,6 +153,7 @@ class ExpenseVisualizer:
         ax.set_ylabel("Expenses")
         ax.set_title(
             f"Monthly Expenses by Category (min {min_percentage:.2f}% of last month)"
+            + self._scope_suffix()
         )
         ax.legend(title="Month")
 
@@ -129,6 +173,9 @@ class ExpenseVisualizer:
             plt.tight_layout()
             plt.show()
 
+    def _scope_suffix(self) -> str:
+        return f" [{self.scope}]" if self.scope else ""
+
     def plot_monthly_expenses(self, min_percentage: float = 1.0, ax=None):
         logger.info("Preparing data for expense plot...")
         filtered_data = self._filter_categories_by_threshold(min_percentage)
@@ -137,7 +184,7 @@ class ExpenseVisualizer:
             return
         self._plot_bar_chart(filtered_data, min_percentage, ax)
 
-    def plot_monthly_totals(self, ax=None):
+    def _monthly_totals(self) -> Tuple[List[str], List[float], List[float]]:
         logger.info(
             "Computing monthly totals for expenses and earnings from split data..."
         )
@@ -152,15 +199,18 @@ class ExpenseVisualizer:
                 total_earnings[month] += amount
 
         months = sorted(set(total_expenses) | set(total_earnings))
+        exp_values = [abs(total_expenses.get(m, 0.0)) for m in months]
+        earn_values = [abs(total_earnings.get(m, 0.0)) for m in months]
+        return months, exp_values, earn_values
+
+    def plot_monthly_totals(self, ax=None):
+        months, exp_values, earn_values = self._monthly_totals()
         x = range(len(months))
         bar_width = 0.35
 
         if ax is None:
             fig, ax = plt.subplots(figsize=(10, 6))
 
-        exp_values = [abs(total_expenses.get(m, 0.0)) for m in months]
-        earn_values = [abs(total_earnings.get(m, 0.0)) for m in months]
-
         exp_bars = ax.bar(
             [i - bar_width / 2 for i in x],
             exp_values,
@@ -177,7 +227,7 @@ class ExpenseVisualizer:
         ax.set_xticks(x)
         ax.set_xticklabels(months, rotation=45, ha="right")
         ax.set_ylabel("Amount")
-        ax.set_title("Total Monthly Expenses vs. Earnings")
+        ax.set_title("Total Monthly Expenses vs. Earnings" + self._scope_suffix())
         ax.legend()
 
         max_val = max(exp_values + earn_values, default=0)
@@ -209,6 +259,177 @@ class ExpenseVisualizer:
         return fig
 
 
-def plot_statistics(gt: GroupedTransactions) -> Figure:
-    visualizer = ExpenseVisualizer(gt.get_categories())
+class SummaryFigureTemplate:
+    """
+    The combined summary laid out once on an Agg canvas and redrawn in place.
+    Bars of each panel are a single PolyCollection and value labels come from
+    a pool of reused Text artists, so a redraw does not create hundreds of
+    artists. Images are encoded straight from the Agg RGBA buffer.
+    """
+
+    def __init__(self, dpi: int = RENDER_DPI):
+        self.fig = Figure(figsize=(14, 10), dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax_totals, self.ax_expenses = self.fig.subplots(2, 1, height_ratios=[1, 2])
+        self._totals_bars = PolyCollection([])
+        self._expense_bars = PolyCollection([])
+        self.ax_totals.add_collection(self._totals_bars)
+        self.ax_expenses.add_collection(self._expense_bars)
+        label_offset = offset_copy(
+            self.ax_totals.transData, fig=self.fig, y=-4, units="points"
+        )
+        self._totals_labels = _TextPool(
+            self.ax_totals, transform=label_offset, va="top", clip_on=True
+        )
+        self._expense_labels = _TextPool(self.ax_expenses, va="bottom")
+
+    @staticmethod
+    def _bar_verts(x: float, width: float, height: float) -> List[Tuple[float, float]]:
+        left, right = x - width / 2, x + width / 2
+        return [(left, 0.0), (left, height), (right, height), (right, 0.0)]
+
+    def _update_totals(self, visualizer: ExpenseVisualizer) -> None:
+        ax = self.ax_totals
+        months, exp_values, earn_values = visualizer._monthly_totals()
+        bar_width = 0.35
+        verts, colors, labels = [], [], []
+        for i in range(len(months)):
+            for dx, value, color in (
+                (-bar_width / 2, exp_values[i], "C0"),
+                (bar_width / 2, earn_values[i], "C1"),
+            ):
+                verts.append(self._bar_verts(i + dx, bar_width, value))
+                colors.append(color)
+                labels.append((i + dx, value, f"{value:.0f}"))
+        self._totals_bars.set_verts(verts)
+        self._totals_bars.set_facecolor(colors)
+        self._totals_labels.show(labels)
+
+        ax.set_xticks(range(len(months)))
+        ax.set_xticklabels(months, rotation=45, ha="right")
+        ax.set_ylabel("Amount")
+        ax.set_title("Total Monthly Expenses vs. Earnings" + visualizer._scope_suffix())
+        ax.legend(
+            handles=[
+                Patch(color="C0", label="Expenses"),
+                Patch(color="C1", label="Earnings"),
+            ]
+        )
+        max_val = max(exp_values + earn_values, default=0)
+        ax.set_xlim(-0.6, max(len(months) - 0.4, 0.6))
+        ax.set_ylim(0, max_val * 1.10 or 1.0)
+
+    def _update_expenses(
+        self, visualizer: ExpenseVisualizer, min_percentage: float
+    ) -> None:
+        ax = self.ax_expenses
+        data = visualizer._filter_categories_by_threshold(min_percentage)
+        categories = sorted(data.keys())
+        months = sorted({m for v in data.values() for m in v})
+        bar_width = 0.8 / len(months) if months else 0.8
+
+        verts, colors, labels = [], [], []
+        for idx, month in enumerate(months):
+            for i, cat in enumerate(categories):
+                value = abs(data[cat].get(month, 0.0))
+                verts.append(self._bar_verts(i + idx * bar_width, bar_width, value))
+                colors.append(f"C{idx % 10}")
+        max_val = 0.0
+        for i, cat in enumerate(categories):
+            cat_max = max(abs(v) for v in data[cat].values())
+            max_val = max(max_val, cat_max)
+            x_pos = i + bar_width * len(months) / 2
+            labels.append((x_pos, cat_max + 0.02 * cat_max, f"{cat_max:.0f}"))
+        self._expense_bars.set_verts(verts)
+        self._expense_bars.set_facecolor(colors)
+        self._expense_labels.show(labels)
+
+        ax.set_xticks([i + bar_width * len(months) / 2 for i in range(len(categories))])
+        ax.set_xticklabels(categories, rotation=45, ha="right")
+        ax.set_ylabel("Expenses")
+        ax.set_title(
+            f"Monthly Expenses by Category (min {min_percentage:.2f}% of last month)"
+            + visualizer._scope_suffix()
+        )
+        legend = ax.get_legend()
+        if legend is not None:
+            legend.remove()
+        if months:
+            ax.legend(
+                handles=[
+                    Patch(color=f"C{idx % 10}", label=m) for idx, m in enumerate(months)
+                ],
+                title="Month",
+            )
+        ax.set_xlim(-bar_width, max(len(categories) - 0.2, 0.8))
+        ax.set_ylim(0, max_val * 1.10 or 1.0)
+
+    def update(self, visualizer: ExpenseVisualizer, min_percentage: float) -> None:
+        logger.info("Updating summary figure template...")
+        self._update_totals(visualizer)
+        self._update_expenses(visualizer, min_percentage)
+        self.fig.tight_layout()
+
+    def render(self, fmt: str = "png", quality: int = 85) -> BytesIO:
+        self.canvas.draw()
+        width, height = self.canvas.get_width_height()
+        image = Image.frombuffer(
+            "RGBA", (width, height), self.canvas.buffer_rgba(), "raw", "RGBA", 0, 1
+        )
+        out = BytesIO()
+        if fmt == "png":
+            image.save(out, format="PNG", compress_level=1)
+        elif fmt in ("jpeg", "jpg"):
+            image.convert("RGB").save(out, format="JPEG", quality=quality)
+        elif fmt == "webp":
+            image.save(out, format="WEBP", quality=quality)
+        else:
+            raise ValueError(f"Unsupported image format: {fmt}")
+        out.seek(0)
+        return out
+
+
+class _TextPool:
+    def __init__(self, ax, **text_kwargs):
+        self._ax = ax
+        self._kwargs = dict(ha="center", fontsize=8, **text_kwargs)
+        self._texts = []
+
+    def show(self, labels: List[Tuple[float, float, str]]) -> None:
+        while len(self._texts) < len(labels):
+            self._texts.append(self._ax.text(0, 0, "", **self._kwargs))
+        for text, (x, y, value) in zip(self._texts, labels):
+            text.set_position((x, y))
+            text.set_text(value)
+            text.set_visible(True)
+        for text in self._texts[len(labels) :]:
+            text.set_visible(False)
+
+
+_SUMMARY_TEMPLATE: Optional[SummaryFigureTemplate] = None
+# The template is one shared figure, renders from several threads take turns
+_SUMMARY_TEMPLATE_LOCK = threading.Lock()
+
+
+def render_statistics(
+    gt: GroupedTransactions,
+    sender: Optional[str] = None,
+    last_months: Optional[int] = None,
+    fmt: str = "png",
+) -> BytesIO:
+    global _SUMMARY_TEMPLATE
+    visualizer = ExpenseVisualizer.from_grouped(gt, sender, last_months)
+    with _SUMMARY_TEMPLATE_LOCK:
+        if _SUMMARY_TEMPLATE is None:
+            _SUMMARY_TEMPLATE = SummaryFigureTemplate()
+        _SUMMARY_TEMPLATE.update(visualizer, min_percentage=2.0)
+        return _SUMMARY_TEMPLATE.render(fmt)
+
+
+def plot_statistics(
+    gt: GroupedTransactions,
+    sender: Optional[str] = None,
+    last_months: Optional[int] = None,
+) -> Figure:
+    visualizer = ExpenseVisualizer.from_grouped(gt, sender, last_months)
     return visualizer.plot_combined_summary(min_percentage=2.0)
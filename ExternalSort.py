@@ -0,0 +1,97 @@
+import heapq
+import logging
+import pickle
+import sys
+import tempfile
+from typing import Any, BinaryIO, Callable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BUDGET = 256 << 20
+# Rows are pickled in blocks, a merge keeps one block per run in memory
+RUN_BLOCK_ROWS = 1024
+# Object headers, tuple slots and small fields that getsizeof does not follow
+ROW_OVERHEAD = 400
+
+
+def estimate_row_size(row: Any) -> int:
+    """Rough footprint of a row ending in a Transaction: its strings plus a constant."""
+    tx = row[-1]
+    return ROW_OVERHEAD + sys.getsizeof(tx.raw) + sys.getsizeof(tx.receiver)
+
+
+class ExternalSorter:
+    """
+    Sorts rows that do not fit into memory. Rows are buffered until their
+    estimated size exceeds memory_budget, then the buffer is sorted and
+    spilled to a temporary run file. merged() does a k-way merge of all runs
+    and the remaining buffer, so memory stays bounded by the budget plus one
+    block per run. Rows only need to be picklable and comparable.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = DEFAULT_MEMORY_BUDGET,
+        row_size: Callable[[Any], int] = estimate_row_size,
+        tmp_dir: Optional[str] = None,
+    ):
+        self._budget = memory_budget
+        self._row_size = row_size
+        self._tmp_dir = tmp_dir
+        self._buffer: List[Any] = []
+        self._buffer_size = 0
+        self._runs: List[BinaryIO] = []
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, row: Any) -> None:
+        self._buffer.append(row)
+        self._buffer_size += self._row_size(row)
+        self._count += 1
+        if self._buffer_size >= self._budget:
+            self._spill()
+
+    def _spill(self) -> None:
+        self._buffer.sort()
+        run = tempfile.TemporaryFile(prefix="run-", dir=self._tmp_dir)
+        for i in range(0, len(self._buffer), RUN_BLOCK_ROWS):
+            pickle.dump(
+                self._buffer[i : i + RUN_BLOCK_ROWS],
+                run,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        run.seek(0)
+        self._runs.append(run)
+        logger.info(f"Spilled run {len(self._runs)} of {len(self._buffer)} rows")
+        self._buffer = []
+        self._buffer_size = 0
+
+    @staticmethod
+    def _read_run(run: BinaryIO) -> Iterator[Any]:
+        while True:
+            try:
+                block = pickle.load(run)
+            except EOFError:
+                return
+            yield from block
+
+    def merged(self) -> Iterator[Any]:
+        """Yields all rows in sorted order; can be consumed only once."""
+        self._buffer.sort()
+        if not self._runs:
+            return iter(self._buffer)
+        return heapq.merge(*(self._read_run(r) for r in self._runs), self._buffer)
+
+    def close(self) -> None:
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._buffer = []
+
+    def __enter__(self) -> "ExternalSorter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
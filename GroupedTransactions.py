@@ -1,10 +1,27 @@
 from __future__ import annotations
 import csv
+import gzip
+import hashlib
 import io
-from typing import List, Dict, Type, Optional
+import json
+from bisect import bisect_left, bisect_right
+from typing import (
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Tuple,
+    Type,
+)
+from datetime import date
 
 from Categories import Category
-from ReportParsers import Transaction
+from ReportParsers import Bank, Transaction
+from RuleMatcher import RULE_BOOK, UNGROUPED_CATEGORY_NAME
 import logging
 from dataclasses import fields
 import os
@@ -12,6 +29,213 @@ import os
 logger = logging.getLogger(__name__)
 
 
+def format_counts(counts: List[Tuple[str, int]]) -> str:
+    name_w = max((len(name) for name, _ in counts), default=0)
+    cnt_w = max((len(str(cnt)) for _, cnt in counts), default=1)
+    lines = [f"{name:<{name_w}}:\t{cnt:>{cnt_w}}" for name, cnt in counts]
+    return "\n".join(lines)
+
+
+class DateOrderedTransactions:
+    """Transactions of one slice together with their category, in date order."""
+
+    def __init__(self, entries: Optional[List[Tuple[str, Transaction]]] = None):
+        self._entries: List[Tuple[str, Transaction]] = sorted(
+            entries or [], key=lambda e: e[1].date
+        )
+        self._dates: List[date] = [tx.date for _, tx in self._entries]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def insert(self, category: str, tx: Transaction) -> None:
+        i = bisect_right(self._dates, tx.date)
+        self._dates.insert(i, tx.date)
+        self._entries.insert(i, (category, tx))
+
+    def between(
+        self, start: Optional[date] = None, end: Optional[date] = None
+    ) -> List[Tuple[str, Transaction]]:
+        lo = 0 if start is None else bisect_left(self._dates, start)
+        hi = len(self._dates) if end is None else bisect_right(self._dates, end)
+        return self._entries[lo:hi]
+
+    def last_date(self) -> Optional[date]:
+        return self._dates[-1] if self._dates else None
+
+
+def write_rows(
+    out: TextIO, rows: Iterable[Tuple[str, Transaction]], delimiter: str = ","
+) -> int:
+    """Writes the CSV header and (category, transaction) rows in the given order."""
+    writer = csv.writer(out, delimiter=delimiter)
+    writer.writerow(GroupedTransactions.CSV_HEADERS)
+
+    # One row list is refilled for every transaction
+    row: List = [None] * len(GroupedTransactions.CSV_HEADERS)
+    row_count: int = 0
+    for name, tx in rows:
+        row[0] = name
+        row[1] = tx.sender_bank.value
+        row[2] = tx.sender
+        row[3] = tx.receiver
+        row[4] = tx.currency
+        row[5] = tx.date
+        row[6] = tx.amount
+        row[7] = tx.raw
+        writer.writerow(row)
+        row_count += 1
+    logger.info(f"serialized {row_count} grouped transactions")
+    return row_count
+
+
+def _read_rows(reader: Iterator[List[str]]) -> Iterator[Tuple[str, Transaction]]:
+    """Checks the header row and decodes the rows after it."""
+    header = next(reader, None)
+    # Empty input has no rows
+    while header is not None and not any(header):
+        header = next(reader, None)
+    if header is None:
+        return
+    if header != GroupedTransactions.CSV_HEADERS:
+        raise ValueError(
+            f"Unexpected CSV header. Got {header}, expected "
+            f"{GroupedTransactions.CSV_HEADERS}"
+        )
+    for row in reader:
+        if not any(row):  # skip empty rows
+            continue
+        yield row[0], Transaction.from_strings(row[1:])
+
+
+# Database files may be gzip compressed. They keep their names and are told
+# apart by their magic bytes, so every reader accepts both formats and a save
+# keeps the format already on disk.
+GZIP_MAGIC = b"\x1f\x8b"
+DB_COMPRESSION_LEVEL = 3
+
+
+def is_compressed(path: str) -> bool:
+    try:
+        with open(path, mode="rb") as f:
+            return f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    except FileNotFoundError:
+        return False
+
+
+def open_db(path: str, mode: str = "r", compress: bool = False, buffering: int = -1):
+    """
+    Opens a database file as text, or as bytes when mode contains "b".
+    Files opened for reading are decompressed when needed, files opened for
+    writing are compressed when compress is set. Both directions stream.
+    """
+    if "r" in mode:
+        compress = is_compressed(path)
+    if compress:
+        if "b" in mode:
+            return gzip.open(path, mode, compresslevel=DB_COMPRESSION_LEVEL)
+        return gzip.open(
+            path,
+            mode + "t",
+            compresslevel=DB_COMPRESSION_LEVEL,
+            encoding="utf-8",
+            newline="",
+        )
+    if "b" in mode:
+        return open(path, mode, buffering=buffering)
+    return open(path, mode, buffering=buffering, encoding="utf-8", newline="")
+
+
+def _iter_file_rows(path: str, delimiter: str) -> Iterator[Tuple[str, Transaction]]:
+    with open_db(path) as f:
+        yield from _read_rows(csv.reader(f, delimiter=delimiter))
+
+
+# A partitioned database is a directory with one CSV shard per year-month
+# and a manifest of per-shard row counts, content hashes and per-category
+# aggregates. Only shards whose content changes are rewritten.
+SHARD_MANIFEST = "manifest.json"
+
+
+def shard_month(day: date) -> str:
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def shard_path(root: str, month: str) -> str:
+    return os.path.join(root, month + ".csv")
+
+
+def read_manifest(root: str) -> Dict[str, dict]:
+    try:
+        with open(os.path.join(root, SHARD_MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)["shards"]
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(root: str, shards: Dict[str, dict]) -> None:
+    path = os.path.join(root, SHARD_MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"shards": dict(sorted(shards.items()))}, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def summarize_shard(rows: List[Tuple[str, Transaction]], content: str) -> dict:
+    categories: Dict[str, dict] = {}
+    for name, tx in rows:
+        day = tx.date.isoformat()
+        agg = categories.setdefault(
+            name, {"count": 0, "total": 0.0, "first": day, "last": day}
+        )
+        agg["count"] += 1
+        agg["total"] = round(agg["total"] + tx.amount, 2)
+        agg["first"] = min(agg["first"], day)
+        agg["last"] = max(agg["last"], day)
+    return {
+        "rows": len(rows),
+        "sha256": hashlib.sha256(content.encode("utf-8")).hexdigest(),
+        "categories": categories,
+    }
+
+
+def _window_months(
+    months: Iterable[str], start: Optional[date], end: Optional[date]
+) -> List[str]:
+    low = shard_month(start) if start is not None else None
+    high = shard_month(end) if end is not None else None
+    return sorted(
+        m for m in months if (low is None or m >= low) and (high is None or m <= high)
+    )
+
+
+def iter_db_rows(
+    db_path: str,
+    delimiter: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> Iterator[Tuple[str, Transaction]]:
+    """
+    Streams (category, transaction) rows of a database file or partitioned
+    directory. start and end select whole months: every row of a month that
+    overlaps the window is included, so a loaded month can be saved back.
+    """
+    if os.path.isdir(db_path):
+        for month in _window_months(read_manifest(db_path), start, end):
+            yield from _iter_file_rows(shard_path(db_path, month), delimiter)
+        return
+    if not os.path.exists(db_path):
+        return
+    rows = _iter_file_rows(db_path, delimiter)
+    if start is None and end is None:
+        yield from rows
+        return
+    low = shard_month(start) if start is not None else ""
+    high = shard_month(end) if end is not None else "9999-99"
+    for name, tx in rows:
+        if low <= shard_month(tx.date) <= high:
+            yield name, tx
+
+
 class GroupedTransactions:
 
     CSV_HEADERS = [
@@ -43,34 +267,79 @@ class GroupedTransactions:
         cat_map = GroupedTransactions._CategoryMap()
         cat_map.fill(categories)
         self._categories: List[Category] = cat_map.categories()
-
-    def add_transactions(self, transactions: List[Transaction]) -> None:
+        self._by_user: Optional[Dict[str, Dict[Bank, DateOrderedTransactions]]] = None
+
+    def _user_index(self) -> Dict[str, Dict[Bank, DateOrderedTransactions]]:
+        """Built on the first query by sender, loads that never ask skip it."""
+        if self._by_user is None:
+            entries: Dict[str, Dict[Bank, List[Tuple[str, Transaction]]]] = {}
+            for cat in self._categories:
+                name = cat.get_name()
+                for tx in cat.get_transactions():
+                    by_bank = entries.setdefault(tx.sender, {})
+                    by_bank.setdefault(tx.sender_bank, []).append((name, tx))
+            self._by_user = {
+                sender: {b: DateOrderedTransactions(e) for b, e in by_bank.items()}
+                for sender, by_bank in entries.items()
+            }
+        return self._by_user
+
+    def _add_to_category(self, cat: Category, tx: Transaction) -> bool:
+        if not cat.add_transaction(tx):
+            return False
+        if self._by_user is not None:
+            by_bank = self._by_user.setdefault(tx.sender, {})
+            if tx.sender_bank not in by_bank:
+                by_bank[tx.sender_bank] = DateOrderedTransactions()
+            by_bank[tx.sender_bank].insert(cat.get_name(), tx)
+        return True
+
+    def add_transactions(
+        self,
+        transactions: List[Transaction],
+        conflicts: Optional[List[Tuple[Transaction, List[str]]]] = None,
+    ) -> int:
+        """
+        Classifies transactions and returns how many of them were new.
+        A transaction matching several categories raises ValueError, unless
+        a conflicts list is given to collect it (with the matched names).
+        """
+        by_name: Dict[str, Category] = {c.get_name(): c for c in self._categories}
         # Find (or require) the Ungrouped category
-        ungrouped_cat = next(
-            (c for c in self._categories if c.get_name() == "Ungrouped"), None
-        )
+        ungrouped_cat = by_name.get(UNGROUPED_CATEGORY_NAME)
         if ungrouped_cat is None:
             raise RuntimeError(
                 "Ungrouped category must be present in GroupedTransactions."
             )
 
+        matcher = RULE_BOOK.get_matcher()
+        added = 0
         for tx in transactions:
-            # Try all categories EXCEPT Ungrouped
             matched = [
-                cat
-                for cat in self._categories
-                if cat is not ungrouped_cat and cat.is_matched(tx)
+                self._get_or_add_category(by_name, name) for name in matcher.match(tx)
             ]
 
             if len(matched) == 0:
-                ungrouped_cat.add_transaction(tx)
+                added += self._add_to_category(ungrouped_cat, tx)
             elif len(matched) == 1:
-                matched[0].add_transaction(tx)
+                added += self._add_to_category(matched[0], tx)
+            elif conflicts is not None:
+                conflicts.append((tx, sorted(cat.get_name() for cat in matched)))
             else:
-                names = ", ".join(cat.get_name() for cat in matched)
+                names = ", ".join(sorted(cat.get_name() for cat in matched))
                 raise ValueError(
                     f"Transaction matched multiple categories ({names}): {tx}"
                 )
+        return added
+
+    def _get_or_add_category(self, by_name: Dict[str, Category], name: str) -> Category:
+        # Categories can appear after a hot reload of the rule file
+        if name not in by_name:
+            cat_map = GroupedTransactions._CategoryMap()
+            cat_map.fill(self._categories)
+            self._categories = cat_map.categories()
+            by_name.update((c.get_name(), c) for c in self._categories)
+        return by_name[name]
 
     def get_categories(self) -> List[Category]:
         return self._categories
@@ -81,70 +350,77 @@ class GroupedTransactions:
                 return cat
         raise KeyError(f"Category of type {cat_type.__name__} not found")
 
+    def clear_category(self, cat_type: Type[Category]) -> None:
+        self.get_category(cat_type).clear()
+        self._by_user = None
+
+    def get_senders(self) -> List[str]:
+        return sorted(self._user_index())
+
+    def get_sender_banks(self, sender: str) -> List[Bank]:
+        return sorted(self._user_index().get(sender.lower(), {}))
+
+    def get_user_transactions(
+        self,
+        sender: str,
+        bank: Optional[Bank] = None,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+    ) -> List[Tuple[str, Transaction]]:
+        """(category name, transaction) pairs of one sender in date order."""
+        by_bank = self._user_index().get(sender.lower(), {})
+        if bank is not None:
+            slice_ = by_bank.get(bank)
+            return slice_.between(start, end) if slice_ is not None else []
+        out: List[Tuple[str, Transaction]] = []
+        for slice_ in by_bank.values():
+            out.extend(slice_.between(start, end))
+        out.sort(key=lambda e: e[1].date)
+        return out
+
+    def get_latest_dates(self, sender: str) -> Dict[Bank, date]:
+        return {
+            b: slice_.last_date()
+            for b, slice_ in self._user_index().get(sender.lower(), {}).items()
+            if len(slice_) > 0
+        }
+
     def format_category_counts(self) -> str:
-        cats = self.get_categories()
-        name_w = max((len(c.get_name()) for c in cats), default=0)
-        cnt_w = max((len(str(len(c.get_transactions()))) for c in cats), default=1)
-        lines = [
-            f"{c.get_name():<{name_w}}:\t{len(c.get_transactions()):>{cnt_w}}"
-            for c in cats
-        ]
-        return "\n".join(lines)
+        return format_counts(
+            [(c.get_name(), len(c.get_transactions())) for c in self.get_categories()]
+        )
 
     def serialize(self, delimiter: str = ",") -> str:
         buf = io.StringIO()
-        writer = csv.writer(buf, delimiter=delimiter)
-        writer.writerow(self.CSV_HEADERS)
+        self.serialize_to(buf, delimiter=delimiter)
+        return buf.getvalue()
 
-        row_count: int = 0
+    def iter_rows(self) -> Iterator[Tuple[str, Transaction]]:
+        """(category, transaction) rows in canonical file order."""
         for cat in self._categories:
-            cat_name = cat.get_name()
+            name = cat.get_name()
             for tx in cat.get_transactions():
-                writer.writerow(
-                    [
-                        cat_name,
-                    ]
-                    + [
-                        tx.sender_bank.value,
-                        tx.sender,
-                        tx.receiver,
-                        tx.currency,
-                        tx.date,
-                        tx.amount,
-                        tx.raw,
-                    ]
-                )
-                row_count += 1
-        logger.info(f"serialized {row_count} grouped transactions")
-        return buf.getvalue()
+                yield name, tx
+
+    def serialize_to(self, out: TextIO, delimiter: str = ",") -> int:
+        return write_rows(out, self.iter_rows(), delimiter)
 
     @classmethod
     def deserialize(cls, csv_text: str, delimiter: str = ",") -> GroupedTransactions:
-        # Empty input → empty GroupedTransactions
-        if not csv_text.strip():
-            return cls(*[])
-
-        reader = csv.reader(io.StringIO(csv_text), delimiter=delimiter)
-        try:
-            header = next(reader)
-        except StopIteration:
-            return cls(*[])
-
-        if header != cls.CSV_HEADERS:
-            raise ValueError(
-                f"Unexpected CSV header. Got {header}, expected {cls.CSV_HEADERS}"
-            )
+        return cls.deserialize_from(io.StringIO(csv_text), delimiter=delimiter)
+
+    @classmethod
+    def deserialize_from(cls, src: TextIO, delimiter: str = ",") -> GroupedTransactions:
+        return cls.from_rows(_read_rows(csv.reader(src, delimiter=delimiter)))
 
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, Transaction]]) -> GroupedTransactions:
         cat_map = cls._CategoryMap()
         logger.debug(f"Map of known categories is {cat_map.get_names()}")
 
         tx_count: int = 0
-        for row in reader:
-            if not any(row):  # skip empty rows
-                continue
-
-            tx = Transaction.from_strings(row[1:])
-            cat_map.get_cat(row[0]).add_transaction(tx)
+        for name, tx in rows:
+            cat_map.get_cat(name).add_transaction(tx)
             tx_count += 1
         logger.info(f"Deserialized {tx_count} transactions")
         filled_cats = [
@@ -157,43 +433,318 @@ class GroupedTransactions:
 
     @staticmethod
     def list_all_categories() -> List[Category]:
-        out: List[Category] = []
-
-        def rec(cls: Type[Category]):
-            for sub in cls.__subclasses__():
-                out.append(sub)
-                rec(sub)
-
-        rec(Category)
-        concrete: List[Category] = []
-        for c in out:
-            try:
-                concrete.append(c())
-            except TypeError:
-                pass
-        return concrete
+        return RULE_BOOK.make_categories()
 
 
 def load_grouped_transactions_from_dbase(
-    db_path: str, delimiter: str
+    db_path: str,
+    delimiter: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
 ) -> GroupedTransactions:
+    """
+    Loads a database file or partitioned directory. With start or end only
+    the months overlapping that window are loaded, as whole months.
+    """
+    if os.path.isdir(db_path) or start is not None or end is not None:
+        return GroupedTransactions.from_rows(
+            iter_db_rows(db_path, delimiter, start, end)
+        )
     if not os.path.exists(db_path):
         return GroupedTransactions()
-    with open(db_path, mode="r", encoding="utf-8") as f:
-        return GroupedTransactions.deserialize(f.read(), delimiter=delimiter)
+    with open_db(db_path) as f:
+        return GroupedTransactions.deserialize_from(f, delimiter=delimiter)
+
+
+class LazyGroupedTransactions:
+    """
+    Index of a database file that keeps only the byte offset of every row,
+    grouped by category, plus per-category date ranges. Transactions are
+    decoded from the file only when get_transactions() asks for them.
+    """
+
+    _DATE_COLUMN = GroupedTransactions.CSV_HEADERS.index("date")
+
+    def __init__(self, db_path: str, delimiter: str):
+        self._path = db_path
+        self._delimiter = delimiter
+        self._offsets: Dict[str, List[int]] = {
+            name: [] for name in GroupedTransactions._CategoryMap().get_names()
+        }
+        self._date_ranges: Dict[str, Tuple[str, str]] = {}
+        if os.path.exists(db_path):
+            self._scan()
+
+    def _read_row(self, f: BinaryIO) -> Optional[str]:
+        line = f.readline()
+        if not line:
+            return None
+        # A quoted field may span several physical lines
+        while line.count(b'"') % 2 == 1:
+            more = f.readline()
+            if not more:
+                break
+            line += more
+        return line.decode("utf-8")
+
+    def _split(self, line: str) -> List[str]:
+        if '"' not in line:
+            return line.rstrip("\r\n").split(self._delimiter)
+        return next(csv.reader([line], delimiter=self._delimiter))
+
+    def _scan(self) -> None:
+        with open_db(self._path, mode="rb") as f:
+            header = self._read_row(f)
+            while header is not None and not header.strip():
+                header = self._read_row(f)
+            if header is None:
+                return
+            if self._split(header) != GroupedTransactions.CSV_HEADERS:
+                raise ValueError(f"Unexpected CSV header in {self._path}: {header}")
+
+            row_count: int = 0
+            offset = f.tell()
+            line = self._read_row(f)
+            while line is not None:
+                if line.strip():
+                    row = self._split(line)
+                    name = row[0]
+                    if name not in self._offsets:
+                        raise ValueError(f"Unknown category: {name}")
+                    self._offsets[name].append(offset)
+                    tx_date = row[self._DATE_COLUMN]
+                    first, last = self._date_ranges.get(name, (tx_date, tx_date))
+                    self._date_ranges[name] = (min(first, tx_date), max(last, tx_date))
+                    row_count += 1
+                offset = f.tell()
+                line = self._read_row(f)
+        logger.info(f"Indexed {row_count} rows of {self._path}")
+
+    def get_category_names(self) -> List[str]:
+        return sorted(self._offsets)
+
+    def has_category(self, name: str) -> bool:
+        return len(self._offsets.get(name, [])) > 0
+
+    def count(self, name: str) -> int:
+        return len(self._offsets[name])
+
+    def total_count(self) -> int:
+        return sum(len(v) for v in self._offsets.values())
+
+    def get_date_range(self, name: Optional[str] = None) -> Optional[Tuple[date, date]]:
+        ranges = (
+            list(self._date_ranges.values())
+            if name is None
+            else [self._date_ranges[name]] if name in self._date_ranges else []
+        )
+        if not ranges:
+            return None
+        first = min(r[0] for r in ranges)
+        last = max(r[1] for r in ranges)
+        return (date.fromisoformat(first), date.fromisoformat(last))
+
+    def format_category_counts(self) -> str:
+        return format_counts([(n, self.count(n)) for n in self.get_category_names()])
+
+    def get_transactions(self, name: str) -> List[Transaction]:
+        out: List[Transaction] = []
+        # Offsets ascend, so a compressed file is decompressed in one pass
+        with open_db(self._path, mode="rb") as f:
+            for offset in self._offsets[name]:
+                f.seek(offset)
+                out.append(Transaction.from_strings(self._split(self._read_row(f))[1:]))
+        out.sort(key=Transaction.sort_key)
+        return out
+
+    def load(self) -> GroupedTransactions:
+        return load_grouped_transactions_from_dbase(self._path, self._delimiter)
+
+
+class PartitionedLazyGroupedTransactions:
+    """
+    LazyGroupedTransactions for a partitioned directory. Counts and date
+    ranges come from the manifest, shards are read only for transactions.
+    """
+
+    def __init__(self, root: str, delimiter: str):
+        self._root = root
+        self._delimiter = delimiter
+        self._shards = read_manifest(root)
+        self._names = GroupedTransactions._CategoryMap().get_names()
+
+    def _aggregates(self, name: str) -> List[dict]:
+        return [
+            shard["categories"][name]
+            for shard in self._shards.values()
+            if name in shard["categories"]
+        ]
+
+    def get_category_names(self) -> List[str]:
+        return list(self._names)
+
+    def has_category(self, name: str) -> bool:
+        return self.count(name) > 0
+
+    def count(self, name: str) -> int:
+        return sum(agg["count"] for agg in self._aggregates(name))
+
+    def total_count(self) -> int:
+        return sum(shard["rows"] for shard in self._shards.values())
+
+    def get_date_range(self, name: Optional[str] = None) -> Optional[Tuple[date, date]]:
+        names = self._names if name is None else [name]
+        aggs = [agg for n in names for agg in self._aggregates(n)]
+        if not aggs:
+            return None
+        return (
+            date.fromisoformat(min(agg["first"] for agg in aggs)),
+            date.fromisoformat(max(agg["last"] for agg in aggs)),
+        )
+
+    def format_category_counts(self) -> str:
+        return format_counts([(n, self.count(n)) for n in self.get_category_names()])
+
+    def get_transactions(self, name: str) -> List[Transaction]:
+        out: List[Transaction] = []
+        for month in sorted(self._shards):
+            if name in self._shards[month]["categories"]:
+                path = shard_path(self._root, month)
+                out.extend(
+                    tx for n, tx in _iter_file_rows(path, self._delimiter) if n == name
+                )
+        out.sort(key=Transaction.sort_key)
+        return out
+
+    def load(self) -> GroupedTransactions:
+        return load_grouped_transactions_from_dbase(self._root, self._delimiter)
+
+
+def load_lazy_grouped_transactions_from_dbase(db_path: str, delimiter: str):
+    if os.path.isdir(db_path):
+        return PartitionedLazyGroupedTransactions(db_path, delimiter)
+    return LazyGroupedTransactions(db_path, delimiter)
+
+
+_DIGEST_MASK = (1 << 64) - 1
+
+
+class CategoryDigest(NamedTuple):
+    count: int
+    row_sum: int
+
+
+def category_digest(transactions: Iterable[Transaction]) -> CategoryDigest:
+    """Order-independent digest: row count and the sum of row hashes mod 2**64."""
+    count = 0
+    total = 0
+    for tx in transactions:
+        count += 1
+        total += hash(tx)
+    return CategoryDigest(count, total & _DIGEST_MASK)
+
+
+def category_digests(grouped: GroupedTransactions) -> Dict[str, CategoryDigest]:
+    return {
+        cat.get_name(): category_digest(cat.iter_transactions())
+        for cat in grouped.get_categories()
+    }
+
+
+class MovedTransaction(NamedTuple):
+    transaction: Transaction
+    # None when the transaction is missing on that side
+    source: Optional[str]
+    destination: Optional[str]
+    rule: Optional[str]
+
+
+def _responsible_rule(tx: Transaction, category: Optional[str]) -> Optional[str]:
+    if category is None or category == UNGROUPED_CATEGORY_NAME:
+        return None
+    rules = RULE_BOOK.get_rule_set().get_matching_rules(tx, category)
+    if not rules:
+        return None
+    rule = rules[0]
+    when = "" if rule.match_date is None else f" @ {rule.match_date}"
+    return f"{rule.pattern.pattern!r}{when}"
+
+
+def diff_categories(
+    actual: GroupedTransactions,
+    expected: GroupedTransactions,
+    names: Optional[List[str]] = None,
+) -> List[MovedTransaction]:
+    """
+    Transactions whose category differs between expected and actual, looking
+    only at the given category names (all categories by default).
+    """
+
+    def locate(grouped: GroupedTransactions) -> Dict[Transaction, str]:
+        return {
+            tx: cat.get_name()
+            for cat in grouped.get_categories()
+            if names is None or cat.get_name() in names
+            for tx in cat.get_transactions()
+        }
+
+    before = locate(expected)
+    after = locate(actual)
+    moved = []
+    for tx, source in before.items():
+        destination = after.pop(tx, None)
+        if destination != source:
+            moved.append(
+                MovedTransaction(
+                    tx, source, destination, _responsible_rule(tx, destination)
+                )
+            )
+    for tx, destination in after.items():
+        moved.append(
+            MovedTransaction(tx, None, destination, _responsible_rule(tx, destination))
+        )
+    return sorted(moved, key=lambda m: (m.transaction.date, m.transaction.receiver))
+
+
+def format_moved_transactions(moved: List[MovedTransaction], limit: int = 20) -> str:
+    lines = []
+    for m in moved[:limit]:
+        tx = m.transaction
+        rule = m.rule if m.rule is not None else "no rule"
+        lines.append(
+            f"{tx.date} {tx.sender} {tx.receiver!r} {tx.amount:.2f}: "
+            f"{m.source or '-'} -> {m.destination or '-'} ({rule})"
+        )
+    if len(moved) > limit:
+        lines.append(f"... and {len(moved) - limit} more")
+    return "\n".join(lines)
 
 
 def compare_categories(
     actual: GroupedTransactions, expected: GroupedTransactions
 ) -> Optional[str]:
-    actual_c = actual.get_categories()
-    expected_c = expected.get_categories()
-    if len(actual_c) != len(expected_c):
-        return f"Mismatch of category number actual: {len(actual_c)}; expected: {len(expected_c)}"
-    for e_cat, a_cat in zip(expected_c, actual_c):
-        if e_cat.get_name() != a_cat.get_name():
-            return f"Category mismatch: expected '{e_cat.get_name()}', got '{a_cat.get_name()}'"
-        e_tx = e_cat.get_transactions()
-        a_tx = a_cat.get_transactions()
-        if e_tx != a_tx:
-            return f"Transaction mismatch in category {e_cat.get_name()}\n '{e_tx}' != '{a_tx}'"
+    """
+    Compares per-category digests and only on a mismatch looks for the
+    transactions that moved between the mismatching categories.
+    """
+    actual_d = category_digests(actual)
+    expected_d = category_digests(expected)
+    empty = CategoryDigest(0, 0)
+    mismatched = sorted(
+        name
+        for name in set(actual_d) | set(expected_d)
+        if actual_d.get(name, empty) != expected_d.get(name, empty)
+    )
+    if not mismatched:
+        return None
+
+    counts = ", ".join(
+        f"{name} {expected_d.get(name, empty).count} -> "
+        f"{actual_d.get(name, empty).count}"
+        for name in mismatched
+    )
+    moved = diff_categories(actual, expected, mismatched)
+    return (
+        f"Category mismatch ({counts}), {len(moved)} transactions moved:\n"
+        + format_moved_transactions(moved)
+    )
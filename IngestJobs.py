@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class IngestJob:
+    job_id: str
+    chat_id: int
+    sender: str
+    created: float
+    status: str = JOB_QUEUED
+    stage: str = ""
+    message_id: Optional[int] = None
+    error: Optional[str] = None
+
+    def is_finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+
+class IngestJobQueue:
+    """
+    On-disk queue of ingest jobs. Every job is a '<id>.json' state file next
+    to the '<id>.report' upload, so queued and interrupted jobs are found
+    again after a restart. The report is deleted when the job finishes.
+    Uploads are downloaded to '<id>.part' and only become a report when the
+    job is enqueued; files left behind by abandoned uploads are evicted.
+    """
+
+    def __init__(self, directory: str):
+        self._dir = directory
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self._dir, job_id + ".json")
+
+    def report_path(self, job_id: str) -> str:
+        return os.path.join(self._dir, job_id + ".report")
+
+    def upload_path(self, job_id: str) -> str:
+        """Where an upload is written before its job is enqueued."""
+        os.makedirs(self._dir, exist_ok=True)
+        return os.path.join(self._dir, job_id + ".part")
+
+    def _write(self, path: str, data: bytes) -> None:
+        os.makedirs(self._dir, exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def new_job(self, chat_id: int, sender: str) -> IngestJob:
+        return IngestJob(uuid.uuid4().hex[:8], chat_id, sender, time.time())
+
+    def enqueue(self, job: IngestJob) -> None:
+        """Queues a job whose upload has been written to upload_path."""
+        os.replace(self.upload_path(job.job_id), self.report_path(job.job_id))
+        self.save(job)
+        logger.info(f"Queued ingest job {job.job_id} from {job.sender}")
+
+    def discard_upload(self, job_id: str) -> None:
+        try:
+            os.remove(self.upload_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def save(self, job: IngestJob) -> None:
+        self._write(
+            self._state_path(job.job_id), json.dumps(asdict(job)).encode("utf-8")
+        )
+
+    def load(self, job_id: str) -> Optional[IngestJob]:
+        try:
+            with open(self._state_path(job_id), "r", encoding="utf-8") as f:
+                return IngestJob(**json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def _all(self) -> List[IngestJob]:
+        if not os.path.isdir(self._dir):
+            return []
+        jobs = []
+        for name in os.listdir(self._dir):
+            if name.endswith(".json"):
+                try:
+                    job = self.load(name[: -len(".json")])
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"Skipping unreadable ingest job {name}: {e}")
+                    continue
+                if job is not None:
+                    jobs.append(job)
+        return sorted(jobs, key=lambda j: j.created)
+
+    def pending(self) -> List[IngestJob]:
+        """Queued jobs and jobs interrupted while running, oldest first."""
+        return [j for j in self._all() if not j.is_finished()]
+
+    def finish(self, job: IngestJob, error: Optional[str] = None) -> None:
+        job.status = JOB_FAILED if error is not None else JOB_DONE
+        job.error = error
+        self.save(job)
+        try:
+            os.remove(self.report_path(job.job_id))
+        except FileNotFoundError:
+            pass
+
+    def evict_abandoned(self, ttl_seconds: float) -> int:
+        """
+        Deletes uploads and temporary files older than ttl_seconds that no
+        queued or running job refers to.
+        """
+        if not os.path.isdir(self._dir):
+            return 0
+        pending = {j.job_id for j in self.pending()}
+        cutoff = time.time() - ttl_seconds
+        removed = 0
+        for name in os.listdir(self._dir):
+            job_id, ext = os.path.splitext(name)
+            if ext not in (".report", ".part", ".tmp") or job_id in pending:
+                continue
+            path = os.path.join(self._dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            logger.info(f"Evicted {removed} abandoned upload files")
+        return removed
+
+    def prune(self, max_age_days: int) -> int:
+        """Deletes state files of jobs finished more than max_age_days ago."""
+        cutoff = time.time() - max_age_days * 24 * 3600
+        removed = 0
+        for job in self._all():
+            if job.is_finished() and job.created < cutoff:
+                os.remove(self._state_path(job.job_id))
+                removed += 1
+        return removed
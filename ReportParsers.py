@@ -1,16 +1,32 @@
+from abc import ABC, abstractmethod
 from collections import namedtuple
 from datetime import datetime, date
-from typing import List, Tuple, NamedTuple
+from typing import Dict, Iterable, List, Optional, Tuple, NamedTuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import re
+import sys
 import csv
 import os
 import logging
+import multiprocessing
 from enum import Enum
 from io import StringIO
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 
 logger = logging.getLogger(__name__)
 
+PARALLEL_PARSE_CHUNK_LINES = 20000
+# The bot starts parse pools from worker threads, and forking a process with
+# running threads can leave a lock held in the child
+_PARSE_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+SNIFF_SIZE = 4096
+# Distinct names and dates of a long history fit, a stream of unique values
+# cannot grow the caches without bound
+PARSE_CACHE_SIZE = 65536
+
 
 class Bank(Enum):
     ABN_AMRO = "ABNAMRO"
@@ -23,7 +39,20 @@ class Bank(Enum):
         return self.value < other.value
 
 
-@dataclass(frozen=True, order=True)
+# Senders, receivers, currencies and dates repeat across thousands of rows.
+# These caches normalize each distinct raw value once, and every row holding
+# that value shares the one resulting object.
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def normalize_name(value: str) -> str:
+    return sys.intern(value.lower())
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_date(value: str, fmt: str) -> date:
+    return datetime.strptime(value, fmt).date()
+
+
+@dataclass(frozen=True, slots=True)
 class Transaction:
     sender_bank: Bank
     sender: str
@@ -34,107 +63,321 @@ class Transaction:
     raw: str
 
     def __post_init__(self):
-        object.__setattr__(self, "sender", self.sender.lower())
-        object.__setattr__(self, "receiver", self.receiver.lower())
-        object.__setattr__(self, "currency", self.currency.lower())
+        object.__setattr__(self, "sender", normalize_name(self.sender))
+        object.__setattr__(self, "receiver", normalize_name(self.receiver))
+        object.__setattr__(self, "currency", normalize_name(self.currency))
+
+    @classmethod
+    def from_normalized(
+        cls,
+        sender_bank: Bank,
+        sender: str,
+        receiver: str,
+        currency: str,
+        date: date,
+        amount: float,
+        raw: str,
+    ) -> "Transaction":
+        """
+        Builds a transaction from values that are already normalized, such as
+        database rows, without going through __init__ and __post_init__.
+        """
+        tx = _new_object(cls)
+        _set_sender_bank(tx, sender_bank)
+        _set_sender(tx, sender)
+        _set_receiver(tx, receiver)
+        _set_currency(tx, currency)
+        _set_date(tx, date)
+        _set_amount(tx, amount)
+        _set_raw(tx, raw)
+        return tx
 
     @classmethod
     def from_strings(cls, values: List[str]) -> "Transaction":
-        return cls(
-            Bank(values[0]),
-            values[1],
-            values[2],
-            values[3],
-            datetime.strptime(values[4], "%Y-%m-%d").date(),
+        bank = _BANKS_BY_VALUE.get(values[0])
+        if bank is None:
+            raise ValueError(f"Unknown bank: {values[0]}")
+        # Database values are lowercase already, the cache only shares them
+        return cls.from_normalized(
+            bank,
+            normalize_name(values[1]),
+            normalize_name(values[2]),
+            normalize_name(values[3]),
+            parse_date(values[4], "%Y-%m-%d"),
             float(values[5]),
             values[6],
         )
 
+    def sort_key(self) -> tuple:
+        """
+        Canonical order as a plain tuple. Sorting with key=Transaction.sort_key
+        builds it once per transaction, and the raw line only breaks ties.
+        """
+        return (
+            self.sender_bank.value,
+            self.sender,
+            self.receiver,
+            self.currency,
+            self.date,
+            self.amount,
+            self.raw,
+        )
+
+    def __lt__(self, other: "Transaction") -> bool:
+        return self.sort_key() < other.sort_key()
+
+    def __le__(self, other: "Transaction") -> bool:
+        return self.sort_key() <= other.sort_key()
+
+    def __gt__(self, other: "Transaction") -> bool:
+        return self.sort_key() > other.sort_key()
+
+    def __ge__(self, other: "Transaction") -> bool:
+        return self.sort_key() >= other.sort_key()
+
+
+# Slot descriptors set the fields of a frozen instance directly
+_new_object = object.__new__
+(
+    _set_sender_bank,
+    _set_sender,
+    _set_receiver,
+    _set_currency,
+    _set_date,
+    _set_amount,
+    _set_raw,
+) = (Transaction.__dict__[f.name].__set__ for f in fields(Transaction))
+_BANKS_BY_VALUE = {bank.value: bank for bank in Bank}
+
 
 def parse_float(value: str) -> float:
     return float(value.replace(",", "."))
 
 
+_FILENAME_PATTERN = re.compile(r"([^_/\\]+)_([^_/\\]+)_.+\.\w+$")
+
+
+def _match_filename(file_path: str) -> re.Match:
+    filename = os.path.basename(file_path)
+    match = _FILENAME_PATTERN.search(filename)
+    if not match:
+        raise ValueError(
+            f"Filename '{filename}' does not match expected format '<bank>_<owner>_<...>.ext'"
+        )
+    return match
+
+
 def parse_filename(file_path: str) -> Tuple[str, str]:
     """
     Extracts bank name and account owner from a full file path.
     Returns both values in lowercase.
     Expected filename format: '<bank>_<owner>_<...>.ext'
     """
-    filename = os.path.basename(file_path)
-    match = re.search(r"([^_/\\]+)_([^_/\\]+)_.+\.\w+$", filename)
-    if not match:
-        raise ValueError(
-            f"Filename '{filename}' does not match expected format '<bank>_<owner>_<...>.ext'"
-        )
+    match = _match_filename(file_path)
     return (Bank(match.group(1)), match.group(2))
 
 
-def parse_abn_amro_receiver(raw_description: str) -> str:
-    if raw_description.startswith("BEA, Betaalpas"):
-        match = re.search(r"BEA, Betaalpas\s+(.*?),PAS", raw_description)
-        if match:
-            return match.group(1).strip()
-        raise ValueError(
-            f"Could not extract receiver from BEA, Betaalpas description: {raw_description}"
-        )
+def parse_sender_from_filename(file_path: str) -> str:
+    """
+    Extracts the account owner from '<anything>_<owner>_<...>.ext', the bank
+    part of the name is not interpreted.
+    """
+    return _match_filename(file_path).group(2)
 
-    if raw_description.startswith("SEPA"):
-        match = re.search(r"Naam:\s*(.+?)(?:\s{2,}|$)", raw_description)
-        if match:
-            return match.group(1).strip()
-        raise ValueError(
-            f"Could not extract receiver from SEPA description: {raw_description}"
-        )
 
-    if raw_description.startswith("/TRTP"):
-        match = re.search(r"/NAME/([^/]+)", raw_description)
+class AbnAmroDescription(NamedTuple):
+    receiver: str
+    tx_type: str
+    iban: Optional[str]
+    reference: Optional[str]
+
+
+class ParseFailure(NamedTuple):
+    line_no: int
+    reason: str
+    raw: str
+
+
+class ParseReport:
+    """Lines a parser had to skip, with the reason for each of them."""
+
+    def __init__(self):
+        self.failures: List[ParseFailure] = []
+
+    def add(self, line_no: int, reason: str, raw: str) -> None:
+        self.failures.append(ParseFailure(line_no, reason, raw))
+
+    def extend(self, other: "ParseReport") -> None:
+        self.failures.extend(other.failures)
+
+    def __len__(self) -> int:
+        return len(self.failures)
+
+    def format(self, limit: int = 10) -> str:
+        lines = [f"Line {f.line_no}: {f.reason}" for f in self.failures[:limit]]
+        if len(self.failures) > limit:
+            lines.append(f"... and {len(self.failures) - limit} more")
+        return "\n".join(lines)
+
+
+# Field patterns are matched at the position of their label found with
+# str.find, so the regex engine never scans the whole description.
+_ABN_BEA_RECEIVER = re.compile(r"BEA, Betaalpas\s+(.*?),PAS")
+_ABN_BEA_REFERENCE = re.compile(r"NR:(\w+)")
+_ABN_SEPA_TYPE = re.compile(r"SEPA\s+(.+?)(?:\s{2,}|$)")
+_ABN_SEPA_RECEIVER = re.compile(r"Naam:\s*(.+?)(?:\s{2,}|$)")
+_ABN_SEPA_IBAN = re.compile(r"IBAN:\s*(\S+)")
+_ABN_SEPA_REFERENCE = re.compile(r"Kenmerk:\s*(.+?)(?:\s{2,}|$)")
+_ABN_TRTP_TYPE = re.compile(r"/TRTP/([^/]*)")
+_ABN_TRTP_RECEIVER = re.compile(r"/NAME/([^/]+)")
+_ABN_TRTP_IBAN = re.compile(r"/IBAN/([^/]*)")
+_ABN_TRTP_REFERENCE = re.compile(r"/EREF/([^/]*)")
+_ABN_COLUMNS = re.compile(r"\s{2,}")
+
+
+def _labeled_field(raw: str, label: str, pattern: re.Pattern) -> Optional[str]:
+    pos = raw.find(label)
+    while pos >= 0:
+        match = pattern.match(raw, pos)
         if match:
             return match.group(1).strip()
+        pos = raw.find(label, pos + 1)
+    return None
+
+
+def _abn_bea_receiver(raw: str) -> str:
+    match = _ABN_BEA_RECEIVER.match(raw)
+    if match is None:
         raise ValueError(
-            f"Could not extract receiver from /TRTP description: {raw_description}"
+            f"Could not extract receiver from BEA, Betaalpas description: {raw}"
         )
+    return match.group(1).strip()
+
+
+def _abn_bea_details(raw: str, receiver: str) -> AbnAmroDescription:
+    return AbnAmroDescription(
+        receiver, "BEA", None, _labeled_field(raw, "NR:", _ABN_BEA_REFERENCE)
+    )
+
+
+def _abn_sepa_receiver(raw: str) -> str:
+    receiver = _labeled_field(raw, "Naam:", _ABN_SEPA_RECEIVER)
+    if receiver is None:
+        raise ValueError(f"Could not extract receiver from SEPA description: {raw}")
+    return receiver
+
+
+def _abn_sepa_details(raw: str, receiver: str) -> AbnAmroDescription:
+    tx_type = _ABN_SEPA_TYPE.match(raw)
+    return AbnAmroDescription(
+        receiver,
+        "SEPA " + tx_type.group(1).strip() if tx_type else "SEPA",
+        _labeled_field(raw, "IBAN:", _ABN_SEPA_IBAN),
+        _labeled_field(raw, "Kenmerk:", _ABN_SEPA_REFERENCE),
+    )
 
-    if raw_description.startswith("eCom, Apple Pay"):
-        columns = re.split(r"\s{2,}", raw_description)
-        if len(columns) >= 2:
-            return columns[1].strip()
+
+def _abn_trtp_receiver(raw: str) -> str:
+    receiver = _labeled_field(raw, "/NAME/", _ABN_TRTP_RECEIVER)
+    if receiver is None:
+        raise ValueError(f"Could not extract receiver from /TRTP description: {raw}")
+    return receiver
+
+
+def _abn_trtp_details(raw: str, receiver: str) -> AbnAmroDescription:
+    tx_type = _ABN_TRTP_TYPE.match(raw)
+    return AbnAmroDescription(
+        receiver,
+        tx_type.group(1).strip() if tx_type else "TRTP",
+        _labeled_field(raw, "/IBAN/", _ABN_TRTP_IBAN),
+        _labeled_field(raw, "/EREF/", _ABN_TRTP_REFERENCE),
+    )
+
+
+def _abn_ecom_receiver(raw: str) -> str:
+    columns = _ABN_COLUMNS.split(raw, 2)
+    if len(columns) < 2:
         raise ValueError(
-            f"Could not extract receiver from eCom, Apple Pay description: {raw_description}"
+            f"Could not extract receiver from eCom, Apple Pay description: {raw}"
         )
+    return columns[1].strip()
+
+
+def _abn_ecom_details(raw: str, receiver: str) -> AbnAmroDescription:
+    return AbnAmroDescription(receiver, "eCom", None, None)
+
+
+def _abn_bank_receiver(raw: str) -> str:
+    return "ABN AMRO Bank N.V."
+
+
+def _abn_bank_details(raw: str, receiver: str) -> AbnAmroDescription:
+    return AbnAmroDescription(receiver, "ABN AMRO", None, None)
+
+
+# Keyed on the first four characters of a description. Each entry holds the
+# full prefix the description must start with, the receiver extractor used
+# on the import path and the builder of the remaining description fields.
+_ABN_DESCRIPTION_FORMATS = {
+    prefix[:4]: (prefix, receiver, details)
+    for prefix, receiver, details in (
+        ("BEA, Betaalpas", _abn_bea_receiver, _abn_bea_details),
+        ("SEPA", _abn_sepa_receiver, _abn_sepa_details),
+        ("/TRTP", _abn_trtp_receiver, _abn_trtp_details),
+        ("eCom, Apple Pay", _abn_ecom_receiver, _abn_ecom_details),
+        ("ABN AMRO Bank N.V.", _abn_bank_receiver, _abn_bank_details),
+    )
+}
+
+
+def _abn_description_format(raw_description: str):
+    entry = _ABN_DESCRIPTION_FORMATS.get(raw_description[:4])
+    if entry is None or not raw_description.startswith(entry[0]):
+        raise ValueError(f"Unrecognized receiver format: {raw_description}")
+    return entry
+
+
+def parse_abn_amro_receiver(raw_description: str) -> str:
+    return _abn_description_format(raw_description)[1](raw_description)
 
-    if raw_description.startswith("ABN AMRO Bank N.V."):
-        return "ABN AMRO Bank N.V."
 
-    raise ValueError(f"Unrecognized receiver format: {raw_description}")
+def parse_abn_amro_description(raw_description: str) -> AbnAmroDescription:
+    _, receiver, details = _abn_description_format(raw_description)
+    return details(raw_description, receiver(raw_description))
 
 
-def abn_amro_report_to_transactions(report: StringIO, sender: str) -> List[Transaction]:
+def abn_amro_report_to_transactions(
+    report: Iterable[str],
+    sender: str,
+    line_offset: int = 0,
+    parse_report: Optional[ParseReport] = None,
+) -> List[Transaction]:
     transactions = []
-    for line in report:
+    if parse_report is None:
+        parse_report = ParseReport()
+    for line_no, line in enumerate(report, start=line_offset + 1):
         raw = line.strip()
         parts = raw.split("\t")
 
         if len(parts) != 8:
-            raise ValueError(f"Invalid row format: {raw}")
+            raise ValueError(f"Line {line_no}: invalid row format: {raw}")
 
         currency = parts[1]
 
         try:
-            date = datetime.strptime(parts[2], "%Y%m%d").date()
+            date = parse_date(parts[2], "%Y%m%d")
         except ValueError:
-            raise ValueError(f"Invalid date format: {raw}")
+            raise ValueError(f"Line {line_no}: invalid date format: {raw}")
 
         try:
             amount = parse_float(parts[6])
         except ValueError:
-            raise ValueError(f"Invalid amount: {raw}")
+            raise ValueError(f"Line {line_no}: invalid amount: {raw}")
 
         try:
             receiver = parse_abn_amro_receiver(parts[7])
         except ValueError as e:
-            print(f"{e}")
-            print(parts[7])
+            parse_report.add(line_no, str(e), raw)
             continue
 
         transactions.append(
@@ -152,7 +395,9 @@ def abn_amro_report_to_transactions(report: StringIO, sender: str) -> List[Trans
     return transactions
 
 
-def ing_report_to_transactions(report: StringIO, sender: str) -> List[Transaction]:
+def ing_report_to_transactions(
+    report: Iterable[str], sender: str, line_offset: int = 0
+) -> List[Transaction]:
     transactions = []
 
     csv_delimiter = ";"
@@ -163,11 +408,14 @@ def ing_report_to_transactions(report: StringIO, sender: str) -> List[Transactio
         raise ValueError(f"Unexpected currency header: {headers[6]}")
 
     for row in reader:
+        line_no = line_offset + reader.line_num
         date_str = row[0].strip()
         try:
-            tx_date: date = datetime.strptime(date_str, "%Y%m%d").date()
+            tx_date: date = parse_date(date_str, "%Y%m%d")
         except ValueError:
-            raise ValueError(f"Invalid date format in ING row: {';'.join(row)}")
+            raise ValueError(
+                f"Line {line_no}: invalid date format in ING row: {';'.join(row)}"
+            )
 
         direction = row[5].strip()
         if direction == "Debit":
@@ -175,7 +423,9 @@ def ing_report_to_transactions(report: StringIO, sender: str) -> List[Transactio
         elif direction == "Credit":
             amount = parse_float(row[6])
         else:
-            raise ValueError(f"Unknown transaction direction in row: {';'.join(row)}")
+            raise ValueError(
+                f"Line {line_no}: unknown transaction direction in row: {';'.join(row)}"
+            )
 
         transactions.append(
             Transaction(
@@ -192,17 +442,22 @@ def ing_report_to_transactions(report: StringIO, sender: str) -> List[Transactio
     return transactions
 
 
-def revolut_report_to_transactions(report: StringIO, sender: str) -> List[Transaction]:
+def revolut_report_to_transactions(
+    report: Iterable[str], sender: str, line_offset: int = 0
+) -> List[Transaction]:
     transactions = []
     reader = csv.reader(report)
     header = next(reader)
 
     for row in reader:
+        line_no = line_offset + reader.line_num
         date_str = row[2].strip().split()[0]
         try:
-            tx_date: date = datetime.strptime(date_str, "%Y-%m-%d").date()
+            tx_date: date = parse_date(date_str, "%Y-%m-%d")
         except ValueError:
-            raise ValueError(f"Invalid date format in Revolut row: {','.join(row)}")
+            raise ValueError(
+                f"Line {line_no}: invalid date format in Revolut row: {','.join(row)}"
+            )
 
         transactions.append(
             Transaction(
@@ -219,22 +474,234 @@ def revolut_report_to_transactions(report: StringIO, sender: str) -> List[Transa
     return transactions
 
 
+def _first_line(head: str) -> str:
+    return head.lstrip("\ufeff").split("\n", 1)[0].rstrip("\r")
+
+
+class BankReportParser(ABC):
+    """
+    Parser of one bank's statement format. sniff() looks only at the first
+    SNIFF_SIZE characters of a report and must be cheap, it is called for
+    every registered parser on every upload.
+    """
+
+    bank: Bank
+    has_header: bool = True
+
+    @abstractmethod
+    def sniff(self, head: str) -> bool:
+        pass
+
+    @abstractmethod
+    def parse(
+        self,
+        report: Iterable[str],
+        sender: str,
+        line_offset: int = 0,
+        parse_report: Optional[ParseReport] = None,
+    ) -> List[Transaction]:
+        pass
+
+
+class AbnAmroReportParser(BankReportParser):
+    bank = Bank.ABN_AMRO
+    has_header = False
+
+    def sniff(self, head: str) -> bool:
+        parts = _first_line(head).split("\t")
+        return len(parts) == 8 and len(parts[2]) == 8 and parts[2].isdigit()
+
+    def parse(
+        self,
+        report: Iterable[str],
+        sender: str,
+        line_offset: int = 0,
+        parse_report: Optional[ParseReport] = None,
+    ) -> List[Transaction]:
+        return abn_amro_report_to_transactions(
+            report, sender, line_offset, parse_report
+        )
+
+
+class IngReportParser(BankReportParser):
+    bank = Bank.ING
+
+    def sniff(self, head: str) -> bool:
+        headers = next(csv.reader([_first_line(head)], delimiter=";"), [])
+        return headers[:2] == ["Date", "Name / Description"] and len(headers) >= 7
+
+    def parse(
+        self,
+        report: Iterable[str],
+        sender: str,
+        line_offset: int = 0,
+        parse_report: Optional[ParseReport] = None,
+    ) -> List[Transaction]:
+        return ing_report_to_transactions(report, sender, line_offset)
+
+
+class RevolutReportParser(BankReportParser):
+    bank = Bank.REVOLUT
+
+    def sniff(self, head: str) -> bool:
+        headers = _first_line(head).split(",")
+        return headers[:3] == ["Type", "Product", "Started Date"] and len(headers) >= 8
+
+    def parse(
+        self,
+        report: Iterable[str],
+        sender: str,
+        line_offset: int = 0,
+        parse_report: Optional[ParseReport] = None,
+    ) -> List[Transaction]:
+        return revolut_report_to_transactions(report, sender, line_offset)
+
+
+_BANK_PARSERS: Dict[Bank, BankReportParser] = {}
+
+
+def register_bank_parser(parser: BankReportParser) -> None:
+    if parser.bank in _BANK_PARSERS:
+        raise ValueError(f"Parser for {parser.bank} is already registered")
+    _BANK_PARSERS[parser.bank] = parser
+
+
+def get_bank_parser(bank: Bank) -> BankReportParser:
+    try:
+        return _BANK_PARSERS[bank]
+    except KeyError:
+        raise ValueError(f"Unknown bank: {bank}")
+
+
+def sniff_bank(head: str) -> Bank:
+    """Detects the bank of a report from its first SNIFF_SIZE characters."""
+    head = head[:SNIFF_SIZE]
+    banks = [b for b, parser in _BANK_PARSERS.items() if parser.sniff(head)]
+    if len(banks) != 1:
+        found = ", ".join(b.value for b in banks) or "none"
+        raise ValueError(f"Cannot detect the bank of the report (matches: {found})")
+    return banks[0]
+
+
+register_bank_parser(AbnAmroReportParser())
+register_bank_parser(IngReportParser())
+register_bank_parser(RevolutReportParser())
+
+
 def report_to_transactions(
-    report: StringIO, bank: Bank, sender: str
+    report: Iterable[str],
+    bank: Bank,
+    sender: str,
+    line_offset: int = 0,
+    parse_report: Optional[ParseReport] = None,
 ) -> List[Transaction]:
-    if bank == Bank.ABN_AMRO:
-        return abn_amro_report_to_transactions(report, sender)
-    elif bank == Bank.ING:
-        return ing_report_to_transactions(report, sender)
-    elif bank == Bank.REVOLUT:
-        return revolut_report_to_transactions(report, sender)
-    else:
-        raise ValueError(f"Unknown bank: {bank}")
+    return get_bank_parser(bank).parse(report, sender, line_offset, parse_report)
 
 
-def transactions_from_file(file_path: str) -> List[Transaction]:
+def _report_chunks(
+    lines: List[str], bank: Bank, chunk_lines: int
+) -> List[Tuple[int, int, int]]:
+    """
+    Splits report lines into (start, end, line_offset) chunks on record
+    boundaries. line_offset maps a chunk line number back to the line in the
+    report, CSV chunks get the header row repeated at their top.
+    """
+    has_header = get_bank_parser(bank).has_header
+    chunks: List[Tuple[int, int, int]] = []
+
+    def flush(start: int, end: int) -> None:
+        # Chunk line 1 (or 2 after the repeated header) is report line start + 1
+        chunks.append((start, end, start - 1 if has_header else start))
+
+    start = 1 if has_header and lines else 0
+    quotes = 0
+    for i in range(start, len(lines)):
+        if has_header:
+            quotes += lines[i].count('"')
+        # Never cut inside a quoted field that spans several lines
+        if i + 1 - start >= chunk_lines and quotes % 2 == 0:
+            flush(start, i + 1)
+            start = i + 1
+    if start < len(lines) or not chunks:
+        flush(start, len(lines))
+    return chunks
+
+
+def _chunk_text(lines: List[str], bank: Bank, start: int, end: int) -> str:
+    header = lines[:1] if get_bank_parser(bank).has_header else []
+    return "".join(header + lines[start:end])
+
+
+def _parse_chunk(
+    args: Tuple[str, int, Bank, str],
+) -> Tuple[List[Transaction], ParseReport]:
+    text, line_offset, bank, sender = args
+    parse_report = ParseReport()
+    transactions = report_to_transactions(
+        StringIO(text), bank, sender, line_offset, parse_report
+    )
+    return transactions, parse_report
+
+
+def _report_head(lines: List[str]) -> str:
+    head: List[str] = []
+    size = 0
+    for line in lines:
+        if size >= SNIFF_SIZE:
+            break
+        head.append(line)
+        size += len(line)
+    return "".join(head)
+
+
+def parallel_report_to_transactions(
+    report: StringIO,
+    bank: Optional[Bank],
+    sender: str,
+    workers: Optional[int] = None,
+    chunk_lines: int = PARALLEL_PARSE_CHUNK_LINES,
+    parse_report: Optional[ParseReport] = None,
+) -> List[Transaction]:
+    """
+    Parses large reports in chunks on a process pool, keeping the original
+    order of transactions. Small reports are parsed in this process.
+    The bank is detected from the report contents when it is None.
+    """
+    lines = report.readlines()
+    if bank is None:
+        bank = sniff_bank(_report_head(lines))
+        logger.info(f"Detected {bank.value} report")
+    chunks = _report_chunks(lines, bank, chunk_lines)
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers <= 1:
+        return report_to_transactions(lines, bank, sender, parse_report=parse_report)
+
+    logger.info(
+        f"Parsing {len(lines)} lines in {len(chunks)} chunks on {workers} processes"
+    )
+    transactions: List[Transaction] = []
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context(_PARSE_START_METHOD)
+    ) as pool:
+        for part, part_report in pool.map(
+            _parse_chunk,
+            [
+                (_chunk_text(lines, bank, start, end), offset, bank, sender)
+                for start, end, offset in chunks
+            ],
+        ):
+            transactions.extend(part)
+            if parse_report is not None:
+                parse_report.extend(part_report)
+    return transactions
+
+
+def transactions_from_file(
+    file_path: str, parse_report: Optional[ParseReport] = None
+) -> List[Transaction]:
     assert os.path.isfile(file_path)
-    filename = os.path.basename(file_path)
-    bank, sender = parse_filename(filename)
+    sender = parse_sender_from_filename(file_path)
     with open(file_path, "r", encoding="utf-8") as fin:
-        return report_to_transactions(StringIO(fin.read()), bank, sender)
+        return parallel_report_to_transactions(
+            fin, None, sender, parse_report=parse_report
+        )
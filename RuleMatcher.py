@@ -0,0 +1,490 @@
+import json
+import logging
+import os
+import re
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from Categories import (
+    Category,
+    FlowDirection,
+    MatchArg,
+    MatchDate,
+    RuleCategory,
+    match_receiver_and_date,
+)
+from Constants import CATEGORY_RULES_PATH
+from ReportParsers import Transaction
+
+logger = logging.getLogger(__name__)
+
+UNGROUPED_CATEGORY_NAME = "Ungrouped"
+
+_REGEX_SPECIAL_CHARS = set(".^$*+?{}[]()|\\")
+_OPTIONAL_QUANTIFIERS = set("*?{")
+
+
+class Rule(NamedTuple):
+    category: str
+    pattern: re.Pattern
+    match_date: MatchDate
+
+    def is_matched(self, transaction: Transaction) -> bool:
+        return bool(match_receiver_and_date(self.pattern, self.match_date, transaction))
+
+
+def _as_interval(match_date: MatchDate) -> Tuple[date, date]:
+    if isinstance(match_date, tuple):
+        assert len(match_date) == 2
+        return match_date
+    if isinstance(match_date, date):
+        return (match_date, match_date)
+    raise ValueError(f"Unexpected type of match_date {match_date}, {type(match_date)}")
+
+
+class DateIntervals:
+    """Union of closed date intervals, kept sorted and non-overlapping."""
+
+    def __init__(self):
+        self._always = False
+        self._starts: List[date] = []
+        self._ends: List[date] = []
+
+    def add(self, match_date: MatchDate) -> None:
+        if match_date is None:
+            self._always = True
+            return
+        start, end = _as_interval(match_date)
+        intervals = sorted(list(zip(self._starts, self._ends)) + [(start, end)])
+        self._starts, self._ends = [], []
+        for s, e in intervals:
+            if self._ends and s <= self._ends[-1] + timedelta(days=1):
+                self._ends[-1] = max(self._ends[-1], e)
+            else:
+                self._starts.append(s)
+                self._ends.append(e)
+
+    def contains(self, tx_date: date) -> bool:
+        if self._always:
+            return True
+        i = bisect_right(self._starts, tx_date) - 1
+        return i >= 0 and tx_date <= self._ends[i]
+
+
+def _has_one_to_one_case(text: str) -> bool:
+    # Receivers are lowercased in Transaction, so a case-insensitive literal
+    # can be compared in lowercase as long as its case mapping is one-to-one.
+    return all(len(c.lower()) == 1 and len(c.upper()) == 1 for c in text)
+
+
+def _has_top_level_alternation(source: str) -> bool:
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(source):
+        c = source[i]
+        if c == "\\":
+            i += 2
+            continue
+        if in_class:
+            if c == "]":
+                in_class = False
+        elif c == "[":
+            in_class = True
+            # A ']' right after '[' or '[^' is a literal member of the class
+            if source[i + 1 : i + 2] == "^":
+                i += 1
+            if source[i + 1 : i + 2] == "]":
+                i += 1
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            return True
+        i += 1
+    return False
+
+
+def literal_prefix(pattern: re.Pattern) -> Tuple[Optional[str], bool]:
+    """
+    Extracts the literal text a '^'-anchored pattern must start with.
+    Returns (prefix, is_full) where is_full means the pattern is exactly
+    '^<prefix>$'. Returns (None, False) when no literal prefix can be used.
+    Prefixes of IGNORECASE patterns are returned in lowercase.
+    """
+    ignore_case = bool(pattern.flags & re.IGNORECASE)
+    if pattern.flags & ~(re.UNICODE | re.IGNORECASE):
+        return None, False
+    source = pattern.pattern
+    if not source.startswith("^") or _has_top_level_alternation(source):
+        return None, False
+
+    chars: List[str] = []
+    is_full = False
+    i = 1
+    while i < len(source):
+        c = source[i]
+        if c == "\\":
+            escaped = source[i + 1 : i + 2]
+            if not escaped or escaped.isalnum() or escaped == "_":
+                break  # character class or assertion like \b, \s, \d
+            c = escaped
+            i += 2
+        elif c in _REGEX_SPECIAL_CHARS:
+            is_full = c == "$" and i == len(source) - 1
+            break
+        else:
+            i += 1
+
+        quantifier = source[i : i + 1]
+        if quantifier in _OPTIONAL_QUANTIFIERS:
+            break  # the character is not mandatory
+        chars.append(c)
+        if quantifier == "+":
+            break
+
+    prefix = "".join(chars)
+    if ignore_case:
+        if not _has_one_to_one_case(prefix):
+            return None, False
+        prefix = prefix.lower()
+    if not prefix:
+        return None, False
+    return prefix, is_full
+
+
+class RuleSet:
+    def __init__(self):
+        self._flow_directions: Dict[str, FlowDirection] = {}
+        self._rules: List[Rule] = []
+
+    def add_category(self, name: str, flow_direction: FlowDirection) -> None:
+        known = self._flow_directions.get(name)
+        if known is not None and known != flow_direction:
+            raise ValueError(
+                f"Category {name} is declared as {known.value} and {flow_direction.value}"
+            )
+        self._flow_directions[name] = flow_direction
+
+    def add_rule(self, rule: Rule) -> None:
+        if rule.category not in self._flow_directions:
+            raise ValueError(f"Rule for unknown category: {rule.category}")
+        if rule.category == UNGROUPED_CATEGORY_NAME:
+            raise ValueError(f"{UNGROUPED_CATEGORY_NAME} cannot have matching rules")
+        self._rules.append(rule)
+
+    def get_category_names(self) -> List[str]:
+        return sorted(self._flow_directions)
+
+    def get_flow_direction(self, name: str) -> FlowDirection:
+        return self._flow_directions[name]
+
+    def get_rules(self) -> List[Rule]:
+        return self._rules
+
+    def get_matching_rules(self, transaction: Transaction, name: str) -> List[Rule]:
+        return [
+            r for r in self._rules if r.category == name and r.is_matched(transaction)
+        ]
+
+    def get_match_args(self, name: str) -> List[MatchArg]:
+        return [(r.pattern, r.match_date) for r in self._rules if r.category == name]
+
+    def merge(self, other: "RuleSet") -> "RuleSet":
+        merged = RuleSet()
+        for rule_set in (self, other):
+            for name in rule_set.get_category_names():
+                merged.add_category(name, rule_set.get_flow_direction(name))
+            for rule in rule_set.get_rules():
+                merged.add_rule(rule)
+        return merged
+
+    @classmethod
+    def from_categories(cls, categories: List[Category]) -> "RuleSet":
+        rule_set = cls()
+        for cat in categories:
+            rule_set.add_category(cat.get_name(), cat.get_flow_direction())
+            for pattern, match_date in cat.get_match_args():
+                rule_set.add_rule(Rule(cat.get_name(), pattern, match_date))
+        return rule_set
+
+    @classmethod
+    def from_file(cls, path: str, base: Optional["RuleSet"] = None) -> "RuleSet":
+        """
+        Loads categories and rules from a JSON file of the form:
+        {"categories": [{"name": "Pets", "flow_direction": "expenses",
+          "rules": [{"pattern": "^zooplus\\\\s"},
+                    {"pattern": "^albert$", "ignore_case": true,
+                     "date": ["2025-03-08", "2025-03-09"]},
+                    {"pattern": "^postnl$", "date": "2025-02-12"}]}]}
+        flow_direction may be omitted for categories already declared in
+        base, such as the ones of Category classes.
+        """
+        with open(path, mode="r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        rule_set = cls()
+        for entry in data.get("categories", []):
+            name = entry["name"]
+            if "flow_direction" in entry:
+                rule_set.add_category(name, FlowDirection(entry["flow_direction"]))
+            elif base is not None and name in base._flow_directions:
+                rule_set.add_category(name, base.get_flow_direction(name))
+            for rule in entry.get("rules", []):
+                flags = re.IGNORECASE if rule.get("ignore_case", False) else 0
+                pattern = re.compile(rule["pattern"], flags)
+                rule_set.add_rule(
+                    Rule(name, pattern, _parse_match_date(rule.get("date")))
+                )
+        return rule_set
+
+
+def _parse_match_date(value) -> MatchDate:
+    def parse(s: str) -> date:
+        return datetime.strptime(s, "%Y-%m-%d").date()
+
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return parse(value)
+    if isinstance(value, list) and len(value) == 2:
+        return (parse(value[0]), parse(value[1]))
+    raise ValueError(f"Unexpected rule date {value}")
+
+
+class _TrieNode:
+    __slots__ = ("children", "rules")
+
+    def __init__(self):
+        self.children: Dict[str, _TrieNode] = {}
+        self.rules: List[Rule] = []
+
+
+class _IntervalNode:
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+    def __init__(self, center: date):
+        self.center = center
+        self.by_start: List[Tuple[date, date, Rule]] = []
+        self.by_end: List[Tuple[date, date, Rule]] = []
+        self.left: Optional[_IntervalNode] = None
+        self.right: Optional[_IntervalNode] = None
+
+
+class DateIntervalTree:
+    """Centered interval tree returning the rules active on a given date."""
+
+    def __init__(self, rules: List[Rule]):
+        intervals = [(*_as_interval(r.match_date), r) for r in rules]
+        self._size = len(intervals)
+        self._root = self._build(intervals)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @classmethod
+    def _build(
+        cls, intervals: List[Tuple[date, date, Rule]]
+    ) -> Optional[_IntervalNode]:
+        if not intervals:
+            return None
+        endpoints = sorted(d for start, end, _ in intervals for d in (start, end))
+        node = _IntervalNode(endpoints[len(endpoints) // 2])
+        left, right, here = [], [], []
+        for item in intervals:
+            if item[1] < node.center:
+                left.append(item)
+            elif item[0] > node.center:
+                right.append(item)
+            else:
+                here.append(item)
+        node.by_start = sorted(here, key=lambda item: item[0])
+        node.by_end = sorted(here, key=lambda item: item[1], reverse=True)
+        node.left = cls._build(left)
+        node.right = cls._build(right)
+        return node
+
+    def query(self, tx_date: date) -> List[Rule]:
+        active: List[Rule] = []
+        node = self._root
+        while node is not None:
+            if tx_date < node.center:
+                for start, _, rule in node.by_start:
+                    if start > tx_date:
+                        break
+                    active.append(rule)
+                node = node.left
+            elif tx_date > node.center:
+                for _, end, rule in node.by_end:
+                    if end < tx_date:
+                        break
+                    active.append(rule)
+                node = node.right
+            else:
+                active.extend(rule for _, _, rule in node.by_start)
+                break
+        return active
+
+
+class IndexedMatcher:
+    def __init__(self, rule_set: RuleSet):
+        self._exact: Dict[str, Dict[str, DateIntervals]] = {}
+        self._prefix_root = _TrieNode()
+        self._residual: List[Rule] = []
+        dated: List[Rule] = []
+        for rule in rule_set.get_rules():
+            self._index(rule, dated)
+        self._dated = DateIntervalTree(dated)
+        logger.debug(
+            f"Indexed {len(rule_set.get_rules())} rules: {len(self._exact)} exact, "
+            f"{len(self._dated)} date-bounded, {len(self._residual)} residual"
+        )
+
+    def _index(self, rule: Rule, dated: List[Rule]) -> None:
+        if rule.match_date is not None:
+            start, end = _as_interval(rule.match_date)
+            if start > end:
+                logger.warning(f"Skipping rule with empty date window: {rule}")
+                return
+
+        prefix, is_full = literal_prefix(rule.pattern)
+        if is_full:
+            by_category = self._exact.setdefault(prefix, {})
+            by_category.setdefault(rule.category, DateIntervals()).add(rule.match_date)
+        elif rule.match_date is not None:
+            dated.append(rule)
+        elif prefix is None:
+            self._residual.append(rule)
+        else:
+            node = self._prefix_root
+            for c in prefix:
+                node = node.children.setdefault(c, _TrieNode())
+            node.rules.append(rule)
+
+    def match(self, transaction: Transaction) -> List[str]:
+        receiver = transaction.receiver
+        matched: Dict[str, None] = {}
+
+        exact = self._exact.get(receiver)
+        if exact is None and receiver.endswith("\n"):
+            exact = self._exact.get(receiver[:-1])  # '$' also matches before '\n'
+        if exact is not None:
+            for category, intervals in exact.items():
+                if intervals.contains(transaction.date):
+                    matched[category] = None
+
+        # Only date-bounded rules active on the transaction date are considered
+        for rule in self._dated.query(transaction.date):
+            if rule.category not in matched and rule.pattern.search(receiver):
+                matched[rule.category] = None
+
+        node = self._prefix_root
+        for c in receiver:
+            node = node.children.get(c)
+            if node is None:
+                break
+            for rule in node.rules:
+                if rule.category not in matched and rule.pattern.search(receiver):
+                    matched[rule.category] = None
+
+        for rule in self._residual:
+            if rule.category not in matched and rule.pattern.search(receiver):
+                matched[rule.category] = None
+
+        return list(matched)
+
+
+def list_category_classes() -> List[Category]:
+    out: List[Category] = []
+
+    def rec(cls):
+        for sub in cls.__subclasses__():
+            out.append(sub)
+            rec(sub)
+
+    rec(Category)
+    concrete: List[Category] = []
+    for c in out:
+        try:
+            concrete.append(c())
+        except TypeError:
+            pass
+    return concrete
+
+
+class RuleBook:
+    """
+    Combines rules of the Category classes with the rules from a data file.
+    The file is re-read whenever its modification time changes, so edits
+    are picked up by a running bot without a restart.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compat_source: Callable[[], List[Category]] = list_category_classes,
+    ):
+        self._path = path
+        self._compat_rules = RuleSet.from_categories(compat_source())
+        self._file_stamp: Optional[Tuple[int, int]] = None
+        self._rule_set = self._compat_rules
+        self._matcher = IndexedMatcher(self._rule_set)
+
+    def _stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _reload_if_changed(self) -> None:
+        stamp = self._stamp()
+        if stamp == self._file_stamp:
+            return
+        try:
+            if stamp is None:
+                rule_set = self._compat_rules
+            else:
+                rule_set = self._compat_rules.merge(
+                    RuleSet.from_file(self._path, self._compat_rules)
+                )
+            matcher = IndexedMatcher(rule_set)
+        except (OSError, ValueError, KeyError, re.error) as e:
+            logger.error(f"Cannot load rules from {self._path}, keeping previous: {e}")
+            self._file_stamp = stamp
+            return
+        self._file_stamp = stamp
+        self._rule_set = rule_set
+        self._matcher = matcher
+        logger.info(
+            f"Loaded {len(rule_set.get_rules())} rules for "
+            f"{len(rule_set.get_category_names())} categories"
+        )
+
+    def get_rule_set(self) -> RuleSet:
+        self._reload_if_changed()
+        return self._rule_set
+
+    def get_matcher(self) -> IndexedMatcher:
+        self._reload_if_changed()
+        return self._matcher
+
+    def make_categories(self) -> List[Category]:
+        rule_set = self.get_rule_set()
+        out = list_category_classes()
+        known = set(c.get_name() for c in out)
+        for name in rule_set.get_category_names():
+            if name not in known:
+                out.append(
+                    RuleCategory(
+                        name,
+                        rule_set.get_flow_direction(name),
+                        rule_set.get_match_args(name),
+                    )
+                )
+        return out
+
+
+RULE_BOOK = RuleBook(CATEGORY_RULES_PATH)
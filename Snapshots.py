@@ -0,0 +1,166 @@
+import logging
+import os
+import shutil
+from datetime import datetime
+from typing import List, Optional
+
+from Constants import DB_BACKUP_GENERATIONS
+from GroupedTransactions import SHARD_MANIFEST
+from StatementLedger import StatementLedger
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = ".snapshots"
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        # File systems without hard links get a real copy
+        shutil.copy2(src, dst)
+
+
+class SnapshotManager:
+    """
+    Keeps the previous generations of a database, generation 1 being the
+    newest. A database file is rotated by rename through path.backup.1 ...
+    path.backup.N, so saving never copies the old content. A partitioned
+    directory is snapshotted into root/.snapshots/<seq> as hard links to its
+    shards and manifest. Shards are replaced by rename, so a snapshot only
+    holds its own data for the shards rewritten after it was taken.
+    """
+
+    def __init__(self, path: str, generations: int = DB_BACKUP_GENERATIONS):
+        if generations < 1:
+            raise ValueError(f"At least one generation must be kept, got {generations}")
+        self._path = path
+        self._generations = generations
+
+    def _backup_path(self, generation: int) -> str:
+        return f"{self._path}.backup.{generation}"
+
+    def _snapshot_root(self) -> str:
+        return os.path.join(self._path, SNAPSHOT_DIR)
+
+    def _snapshot_seqs(self) -> List[int]:
+        try:
+            names = os.listdir(self._snapshot_root())
+        except FileNotFoundError:
+            return []
+        return sorted((int(n) for n in names if n.isdigit()), reverse=True)
+
+    def generation_path(self, generation: int) -> str:
+        if os.path.isdir(self._path):
+            seqs = self._snapshot_seqs()
+            if not 1 <= generation <= len(seqs):
+                raise KeyError(f"No generation {generation} of {self._path}")
+            return os.path.join(self._snapshot_root(), str(seqs[generation - 1]))
+        path = self._backup_path(generation)
+        if not os.path.exists(path):
+            raise KeyError(f"No generation {generation} of {self._path}")
+        return path
+
+    def generations(self) -> List[int]:
+        if os.path.isdir(self._path):
+            return list(range(1, len(self._snapshot_seqs()) + 1))
+        return [
+            g
+            for g in range(1, self._generations + 1)
+            if os.path.exists(self._backup_path(g))
+        ]
+
+    def superseded_at(self, generation: int) -> float:
+        """The time the given generation stopped being the current database."""
+        if os.path.isdir(self._path):
+            # A snapshot is taken right before the save that replaces it
+            return os.path.getmtime(self.generation_path(generation))
+        if generation == 1:
+            return os.path.getmtime(self._path)
+        return os.path.getmtime(self.generation_path(generation - 1))
+
+    def describe(self) -> List[str]:
+        lines = []
+        for g in self.generations():
+            path = self.generation_path(g)
+            taken = datetime.fromtimestamp(os.path.getmtime(path))
+            lines.append(f"{g}: {taken:%Y-%m-%d %H:%M:%S} {path}")
+        return lines
+
+    def rotate(self) -> None:
+        """Moves the database file into generation 1, dropping the oldest."""
+        if not os.path.exists(self._path):
+            return
+        oldest = self._backup_path(self._generations)
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for g in range(self._generations - 1, 0, -1):
+            if os.path.exists(self._backup_path(g)):
+                os.replace(self._backup_path(g), self._backup_path(g + 1))
+        os.replace(self._path, self._backup_path(1))
+        logger.info(f"Existing file rotated to {self._backup_path(1)}")
+
+    def _database_files(self) -> List[str]:
+        return [
+            name
+            for name in os.listdir(self._path)
+            if name == SHARD_MANIFEST or name.endswith(".csv")
+        ]
+
+    def _take_snapshot(self) -> None:
+        seqs = self._snapshot_seqs()
+        target = os.path.join(self._snapshot_root(), str(seqs[0] + 1 if seqs else 1))
+        os.makedirs(target)
+        for name in self._database_files():
+            _link_or_copy(os.path.join(self._path, name), os.path.join(target, name))
+        logger.info(f"Snapshot of {self._path} taken in {target}")
+
+    def _prune_snapshots(self) -> None:
+        for seq in self._snapshot_seqs()[self._generations :]:
+            shutil.rmtree(os.path.join(self._snapshot_root(), str(seq)))
+
+    def snapshot(self) -> None:
+        """Links the current shards and manifest into a new generation 1."""
+        if not os.path.exists(os.path.join(self._path, SHARD_MANIFEST)):
+            return
+        self._take_snapshot()
+        self._prune_snapshots()
+
+    def restore(
+        self, generation: int, ledger: Optional[StatementLedger] = None
+    ) -> None:
+        """
+        Makes the given generation current again. The replaced state becomes
+        generation 1, so a restore can itself be undone. Ledger entries
+        recorded after the generation was replaced are dropped, so their
+        statements can be imported again.
+        """
+        source = self.generation_path(generation)
+        # Entries keep whole seconds, rounding down drops rather than keeps
+        superseded = datetime.fromtimestamp(int(self.superseded_at(generation)))
+        if os.path.isdir(self._path):
+            self._take_snapshot()
+            names = sorted(os.listdir(source), key=lambda n: n == SHARD_MANIFEST)
+            for name in self._database_files():
+                if name not in names:
+                    os.remove(os.path.join(self._path, name))
+            # The manifest goes last, it only lists shards already in place
+            for name in names:
+                src = os.path.join(source, name)
+                path = os.path.join(self._path, name)
+                # Renaming onto another link of the same file is a no-op
+                if os.path.exists(path) and os.path.samefile(src, path):
+                    continue
+                _link_or_copy(src, path + ".tmp")
+                os.replace(path + ".tmp", path)
+            self._prune_snapshots()
+        else:
+            tmp_path = self._path + ".tmp"
+            shutil.copyfile(source, tmp_path)
+            self.rotate()
+            os.replace(tmp_path, self._path)
+        logger.warning(f"Restored {self._path} from {source}")
+        if ledger is not None:
+            dropped = ledger.forget_since(superseded)
+            if dropped:
+                logger.warning(f"Dropped {dropped} later statements from the ledger")
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from ReportParsers import Bank, Transaction
+from RuleMatcher import DateIntervals
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_digest(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class StatementSpan(NamedTuple):
+    sender: str
+    bank: Bank
+    start: date
+    end: date
+    rows: int
+
+
+class LedgerEntry(NamedTuple):
+    recorded: datetime
+    spans: List[StatementSpan]
+
+
+class StatementLedger:
+    """
+    Hashes of imported statements with the date span each of them covered
+    per (sender, bank). The file is re-read on every call, so the CLI and
+    the bot see each other's imports.
+
+    Rows dated strictly inside a covered span are already in the database.
+    The first and last day of a span may have been exported partially, so
+    rows on those days are left to the per-transaction deduplication.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def _load(self) -> Dict[str, LedgerEntry]:
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            return {}
+        return {
+            file_hash: LedgerEntry(
+                datetime.fromisoformat(entry["recorded"]),
+                [
+                    StatementSpan(
+                        s["sender"],
+                        Bank(s["bank"]),
+                        date.fromisoformat(s["start"]),
+                        date.fromisoformat(s["end"]),
+                        s["rows"],
+                    )
+                    for s in entry["spans"]
+                ],
+            )
+            for file_hash, entry in raw.items()
+        }
+
+    def _save(self, entries: Dict[str, LedgerEntry]) -> None:
+        raw = {
+            file_hash: {
+                "recorded": entry.recorded.isoformat(timespec="seconds"),
+                "spans": [
+                    {
+                        "sender": s.sender,
+                        "bank": s.bank.value,
+                        "start": s.start.isoformat(),
+                        "end": s.end.isoformat(),
+                        "rows": s.rows,
+                    }
+                    for s in entry.spans
+                ],
+            }
+            for file_hash, entry in entries.items()
+        }
+        with open(self._path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(raw, f, indent=1)
+        os.replace(self._path + ".tmp", self._path)
+
+    def get(self, file_hash: str) -> Optional[LedgerEntry]:
+        return self._load().get(file_hash)
+
+    def forget_since(self, since: datetime) -> int:
+        """Drops the entries recorded at or after since, returns how many."""
+        entries = self._load()
+        kept = {h: e for h, e in entries.items() if e.recorded < since}
+        if len(kept) != len(entries):
+            self._save(kept)
+        return len(entries) - len(kept)
+
+    def _coverage(self) -> Dict[Tuple[str, Bank], DateIntervals]:
+        coverage: Dict[Tuple[str, Bank], DateIntervals] = {}
+        for entry in self._load().values():
+            for s in entry.spans:
+                if (s.end - s.start).days < 2:
+                    continue
+                intervals = coverage.setdefault((s.sender, s.bank), DateIntervals())
+                intervals.add((s.start + timedelta(days=1), s.end - timedelta(days=1)))
+        return coverage
+
+    def filter_uncovered(self, transactions: List[Transaction]) -> List[Transaction]:
+        """Drops transactions of days fully covered by earlier statements."""
+        coverage = self._coverage()
+        if not coverage:
+            return transactions
+        empty = DateIntervals()
+        return [
+            tx
+            for tx in transactions
+            if not coverage.get((tx.sender, tx.sender_bank), empty).contains(tx.date)
+        ]
+
+    def record(self, file_hash: str, transactions: List[Transaction]) -> None:
+        self.record_spans(file_hash, statement_spans(transactions))
+
+    def record_spans(self, file_hash: str, spans: List[StatementSpan]) -> None:
+        entries = self._load()
+        entries[file_hash] = LedgerEntry(datetime.now().replace(microsecond=0), spans)
+        self._save(entries)
+
+
+def statement_spans(transactions: List[Transaction]) -> List[StatementSpan]:
+    spans: Dict[Tuple[str, Bank], StatementSpan] = {}
+    for tx in transactions:
+        key = (tx.sender, tx.sender_bank)
+        s = spans.get(key)
+        if s is None:
+            spans[key] = StatementSpan(*key, tx.date, tx.date, 1)
+        else:
+            spans[key] = StatementSpan(
+                *key, min(s.start, tx.date), max(s.end, tx.date), s.rows + 1
+            )
+    return list(spans.values())
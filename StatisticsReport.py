@@ -0,0 +1,209 @@
+import base64
+import heapq
+import html
+import logging
+import os
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from io import BytesIO
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from Constants import RENDER_DPI
+from ExpenseVisualizer import ExpenseVisualizer, SummaryFigureTemplate
+from GroupedTransactions import GroupedTransactions
+from RuleMatcher import UNGROUPED_CATEGORY_NAME
+from TransactionQuery import TransactionFilter, TransactionQuery, month_window_start
+
+logger = logging.getLogger(__name__)
+
+UNGROUPED_TOP_RECEIVERS = 25
+
+
+class ReportFigure(NamedTuple):
+    """One figure of a report: the file name stem, a renderer kind and its data."""
+
+    name: str
+    kind: str
+    data: Any
+
+
+def _summary_data(visualizer: ExpenseVisualizer) -> Tuple[dict, dict, str]:
+    return (
+        {c: dict(m) for c, m in visualizer.expense_monthly_data.items()},
+        {c: dict(m) for c, m in visualizer.earnings_monthly_data.items()},
+        visualizer.scope,
+    )
+
+
+def _ungrouped_receivers(
+    gt: GroupedTransactions, start: Optional[date]
+) -> List[Tuple[str, int, float]]:
+    counts: Counter = Counter()
+    totals: Dict[str, float] = defaultdict(float)
+    entries = TransactionQuery(gt).entries(
+        TransactionFilter(
+            categories=(UNGROUPED_CATEGORY_NAME,), start=start, max_amount=0.0
+        )
+    )
+    for _, tx in entries:
+        counts[tx.receiver] += 1
+        totals[tx.receiver] += tx.amount
+    top = heapq.nlargest(UNGROUPED_TOP_RECEIVERS, totals, key=lambda r: abs(totals[r]))
+    return [(receiver, counts[receiver], totals[receiver]) for receiver in top]
+
+
+def report_figures(
+    gt: GroupedTransactions, last_months: Optional[int] = None
+) -> List[ReportFigure]:
+    """
+    Aggregates everything the report shows in this process. The figures only
+    carry plain dicts and lists, so they are cheap to send to workers.
+    """
+    start = None
+    if last_months is not None:
+        start = month_window_start(date.today(), last_months)
+    overall = _summary_data(ExpenseVisualizer.from_grouped(gt, None, last_months))
+    figures = [
+        ReportFigure("summary", "summary", overall),
+        ReportFigure("category-trends", "trends", overall),
+        ReportFigure("ungrouped", "ungrouped", _ungrouped_receivers(gt, start)),
+    ]
+    for sender in gt.get_senders():
+        visualizer = ExpenseVisualizer.from_grouped(gt, sender, last_months)
+        slug = re.sub(r"[^a-z0-9]+", "-", sender.lower()).strip("-")
+        figures.append(
+            ReportFigure(f"user-{slug}", "summary", _summary_data(visualizer))
+        )
+    return figures
+
+
+def _png(fig: Figure) -> bytes:
+    out = BytesIO()
+    FigureCanvasAgg(fig).print_png(out)
+    return out.getvalue()
+
+
+def _render_summary(data: Tuple[dict, dict, str]) -> bytes:
+    expenses, earnings, scope = data
+    template = SummaryFigureTemplate()
+    template.update(
+        ExpenseVisualizer.from_monthly_data(expenses, earnings, scope),
+        min_percentage=2.0,
+    )
+    return template.render("png").getvalue()
+
+
+def _render_trends(data: Tuple[dict, dict, str]) -> bytes:
+    expenses, _, scope = data
+    months = sorted({m for v in expenses.values() for m in v})
+    fig = Figure(figsize=(14, 8), dpi=RENDER_DPI)
+    ax = fig.subplots()
+    for cat in sorted(expenses):
+        ax.plot(
+            range(len(months)),
+            [abs(expenses[cat].get(m, 0.0)) for m in months],
+            marker="o",
+            label=cat,
+        )
+    ax.set_xticks(range(len(months)))
+    ax.set_xticklabels(months, rotation=45, ha="right")
+    ax.set_ylabel("Expenses")
+    ax.set_title("Monthly Expenses per Category" + (f" [{scope}]" if scope else ""))
+    if expenses:
+        ax.legend(ncol=2, fontsize=8)
+    fig.tight_layout()
+    return _png(fig)
+
+
+def _render_ungrouped(receivers: List[Tuple[str, int, float]]) -> bytes:
+    fig = Figure(figsize=(12, 8), dpi=RENDER_DPI)
+    ax = fig.subplots()
+    # Largest at the top
+    rows = list(reversed(receivers))
+    ax.barh(
+        [f"{receiver} ({count})" for receiver, count, _ in rows],
+        [abs(total) for _, _, total in rows],
+    )
+    ax.set_xlabel("Expenses")
+    ax.set_title(
+        f"Top {len(receivers)} Ungrouped Receivers by Expenses "
+        "(transaction count in brackets)"
+    )
+    fig.tight_layout()
+    return _png(fig)
+
+
+_RENDERERS = {
+    "summary": _render_summary,
+    "trends": _render_trends,
+    "ungrouped": _render_ungrouped,
+}
+
+
+def _use_agg() -> None:
+    matplotlib.use("Agg")
+
+
+def _render_figure(figure: ReportFigure) -> bytes:
+    return _RENDERERS[figure.kind](figure.data)
+
+
+def _write_html(path: str, images: List[Tuple[str, bytes]], title: str) -> None:
+    parts = [
+        "<!DOCTYPE html>",
+        f"<html><head><meta charset='utf-8'><title>{html.escape(title)}</title>"
+        "</head><body>",
+        f"<h1>{html.escape(title)}</h1>",
+    ]
+    for name, png in images:
+        encoded = base64.b64encode(png).decode("ascii")
+        parts.append(f"<h2>{html.escape(name)}</h2>")
+        parts.append(
+            f"<img alt='{html.escape(name)}' src='data:image/png;base64,{encoded}'>"
+        )
+    parts.append("</body></html>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(parts))
+
+
+def render_report(
+    gt: GroupedTransactions,
+    out_dir: str,
+    last_months: Optional[int] = None,
+    fmt: str = "png",
+    workers: Optional[int] = None,
+) -> List[str]:
+    """
+    Renders the report figures on a process pool, each worker drawing on its
+    own Agg canvases, and writes them to out_dir as PNG files or as a single
+    self-contained report.html. Returns the written paths.
+    """
+    if fmt not in ("png", "html"):
+        raise ValueError(f"Unsupported report format: {fmt}")
+    figures = report_figures(gt, last_months)
+    workers = min(workers or os.cpu_count() or 1, len(figures))
+    logger.info(f"Rendering {len(figures)} figures on {workers} processes")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg) as pool:
+        images = list(zip([f.name for f in figures], pool.map(_render_figure, figures)))
+
+    os.makedirs(out_dir, exist_ok=True)
+    if fmt == "html":
+        path = os.path.join(out_dir, "report.html")
+        title = "Expense report"
+        if last_months is not None:
+            title += f", last {last_months} months"
+        _write_html(path, images, title)
+        return [path]
+    paths = []
+    for name, png in images:
+        path = os.path.join(out_dir, name + ".png")
+        with open(path, "wb") as f:
+            f.write(png)
+        paths.append(path)
+    return paths
@@ -0,0 +1,102 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Callable, List
+
+from CategoriesWriter import CsvCategoriesSaver
+from Constants import DEFAULT_CSV_DELIMITER
+from GroupedTransactions import (
+    GroupedTransactions,
+    load_grouped_transactions_from_dbase,
+)
+from ReportParsers import Bank, Transaction, normalize_name, parse_date
+
+BRANDS = [
+    "albert heijn",
+    "jumbo supermarkt",
+    "ns groep iz ns reizigers",
+    "spotify",
+    "uber bv",
+    "bol.com",
+    "vattenfall klantenservice",
+    "kruidvat",
+    "hema",
+    "action",
+    "etos",
+    "coolblue",
+    "shell",
+    "tinq",
+    "lidl",
+    "gamma",
+    "ikea",
+    "thuisbezorgd.nl",
+    "bakkerij bart",
+    "parkeren amsterdam",
+]
+# Store and terminal numbers make thousands of distinct receivers, as in a
+# real history
+STORE_NUMBERS = 500
+
+
+def synthetic_transactions(count: int, seed: int = 0) -> List[Transaction]:
+    """Rows shaped like ABN AMRO lines, including a raw line of realistic length."""
+    rnd = random.Random(seed)
+    first = date(2015, 1, 1)
+    out = []
+    for i in range(count):
+        day = first + timedelta(days=rnd.randrange(3650))
+        receiver = f"{rnd.choice(BRANDS)} {rnd.randrange(STORE_NUMBERS):04d}"
+        amount = round(rnd.uniform(-150, 20), 2)
+        raw = (
+            f"123456789\tEUR\t{day:%Y%m%d}\t1000,00\t{1000 + amount:.2f}\t"
+            f"{day:%Y%m%d}\t{amount:.2f}\tBEA, Betaalpas {receiver.upper()},"
+            f"PAS{rnd.randrange(1000):03d} NR:{i:08d}, {day:%d.%m.%y}/12:00 AMSTERDAM"
+        )
+        out.append(
+            Transaction(Bank.ABN_AMRO, "bench", receiver, "EUR", day, amount, raw)
+        )
+    return out
+
+
+def _best_of(repeat: int, func: Callable[[], None]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _cold_load(path: str, delimiter: str) -> None:
+    # Every load starts with empty parse caches, as a fresh process does
+    normalize_name.cache_clear()
+    parse_date.cache_clear()
+    load_grouped_transactions_from_dbase(path, delimiter)
+
+
+def run(count: int, delimiter: str, repeat: int) -> None:
+    grouped = GroupedTransactions()
+    grouped.add_transactions(synthetic_transactions(count))
+    print(f"{count} transactions, best of {repeat}")
+    print(f"{'format':<8}{'size MB':>10}{'save s':>10}{'load s':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, compress in (("plain", False), ("gzip", True)):
+            path = os.path.join(tmp, label + ".csv")
+            saver = CsvCategoriesSaver(compress=compress, generations=1)
+            save = _best_of(repeat, lambda: saver.save(grouped, path, delimiter))
+            load = _best_of(repeat, lambda: _cold_load(path, delimiter))
+            size = os.path.getsize(path) / (1 << 20)
+            print(f"{label:<8}{size:>10.1f}{save:>10.2f}{load:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare save and load times of plain and gzip databases."
+    )
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.rows, DEFAULT_CSV_DELIMITER, args.repeat)
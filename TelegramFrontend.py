@@ -1,22 +1,38 @@
 import os
+import asyncio
 import logging
-from io import BytesIO, StringIO
+from io import BytesIO
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Bot, Update
+from telegram.error import TelegramError
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
-    CallbackQueryHandler,
     ContextTypes,
     filters,
 )
-from typing import Optional, Dict
-from main import plot_current_db_statistics, update_database
+from typing import Callable, Optional, List, Tuple
+from main import (
+    UpdateResult,
+    render_current_db_statistics,
+    update_database_from_file,
+)
 from GroupedTransactions import load_grouped_transactions_from_dbase
-import matplotlib.pyplot as plt
-from Constants import DEFAULT_CSV_DELIMITER, GROUPED_CATEGORIES_CSV_PATH
+from IngestJobs import IngestJob, IngestJobQueue, JOB_RUNNING
+from StatementLedger import StatementLedger, file_digest
+from Constants import (
+    DEFAULT_CSV_DELIMITER,
+    DEFAULT_SHOW_MONTHS,
+    GROUPED_CATEGORIES_CSV_PATH,
+    INGEST_JOB_RETENTION_DAYS,
+    INGEST_JOBS_DIR,
+    INGEST_UPLOAD_TTL_HOURS,
+    STATEMENT_LEDGER_PATH,
+    STATISTICS_IMAGE_FORMAT,
+)
 from ReportParsers import Bank
+from TransactionQuery import TransactionQuery, TransactionFilter, month_bounds
 from datetime import date
 
 logging.basicConfig(
@@ -32,6 +48,11 @@ ALLOWED_USER_IDS = set(
     if u.strip()
 )
 
+INGEST_STAGES = ("parse", "classify", "save", "render")
+PROGRESS_EDIT_TIMEOUT = 30
+JOB_QUEUE = IngestJobQueue(INGEST_JOBS_DIR)
+LEDGER = StatementLedger(STATEMENT_LEDGER_PATH)
+
 
 def guarded(func):
 
@@ -52,115 +73,229 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Hi! Send a transaction report from your bank account (.txt or .csv) and I will update DB with it.
         You can use:
         - /last to see the date of your last submitted transaction
-        - /show to see stats from transactions in database
+        - /show [me|<name>] [<months>|all] to see stats from transactions in database
+        - /spent <category> to see this month's total of one category
+        - /job <id> to see the state of an uploaded report
         """
     )
 
 
+def _parse_show_args(
+    args: List[str], user_name: str
+) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Parses '/show [me|<sender>] [<months>|all]'. Without arguments the chart
+    covers the whole household over the last DEFAULT_SHOW_MONTHS months.
+    """
+    sender: Optional[str] = None
+    last_months: Optional[int] = DEFAULT_SHOW_MONTHS
+    for arg in args:
+        if arg.isdigit() and int(arg) > 0:
+            last_months = int(arg)
+        elif arg.lower() == "all":
+            last_months = None
+        elif arg.lower() == "me":
+            sender = user_name.lower()
+        else:
+            sender = arg.lower()
+    return sender, last_months
+
+
 async def report_current_db_statistics(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
-    img_buf = BytesIO()
-    fig = plot_current_db_statistics(GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER)
-    fig.savefig(img_buf, format="png")
-    plt.close(fig)
-    img_buf.seek(0)
+    sender, last_months = _parse_show_args(
+        context.args or [], str(update.effective_user.first_name)
+    )
+    # Rendering may wait for an ingest job's render, keep the bot loop free
+    img_buf = await asyncio.to_thread(
+        render_current_db_statistics,
+        GROUPED_CATEGORIES_CSV_PATH,
+        DEFAULT_CSV_DELIMITER,
+        sender=sender,
+        last_months=last_months,
+        fmt=STATISTICS_IMAGE_FORMAT,
+    )
 
     await context.bot.send_photo(chat_id=update.effective_chat.id, photo=img_buf)
 
 
-def _bank_keyboard() -> InlineKeyboardMarkup:
-    prefix = lambda x: "bank:" + x
-    buttons = [
-        [
-            InlineKeyboardButton(
-                text="ABN AMRO", callback_data=prefix(Bank.ABN_AMRO.value)
-            ),
-            InlineKeyboardButton(text="ING", callback_data=prefix(Bank.ING.value)),
-            InlineKeyboardButton(
-                text="Revolut", callback_data=prefix(Bank.REVOLUT.value)
-            ),
-        ]
-    ]
-    return InlineKeyboardMarkup(buttons)
-
-
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message or not update.message.document:
         return
 
     doc = update.message.document
 
+    sender = str(update.effective_user.first_name)
+    job = JOB_QUEUE.new_job(update.effective_chat.id, sender)
+
+    # The upload goes straight to disk and is decoded while it is parsed
     tg_file = await doc.get_file()
-    raw_bytes = await tg_file.download_as_bytearray()
-    try:
-        report = StringIO(raw_bytes.decode("utf-8", errors="strict"))
-    except UnicodeDecodeError:
+    upload_path = JOB_QUEUE.upload_path(job.job_id)
+    await tg_file.download_to_drive(upload_path)
+
+    known = LEDGER.get(await asyncio.to_thread(file_digest, upload_path))
+    if known is not None:
+        JOB_QUEUE.discard_upload(job.job_id)
         await update.message.reply_text(
-            "Encoding error. Please send the file encoded as UTF-8."
+            f"This statement was already imported on {known.recorded:%Y-%m-%d}."
         )
         return
 
-    context.user_data["pending_report"] = report
-    await update.message.reply_text(
-        "Which bank is this statement from?", reply_markup=_bank_keyboard()
-    )
+    message = await update.message.reply_text(f"Ingest job {job.job_id}: queued")
+    job.message_id = message.message_id
+    JOB_QUEUE.enqueue(job)
+    await context.application.bot_data["ingest_queue"].put(job.job_id)
 
 
-async def on_bank_chosen(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    if not query or not query.data or not query.data.startswith("bank:"):
+async def _show_job_progress(bot: Bot, job: IngestJob, text: str) -> None:
+    if job.message_id is None:
         return
-
-    await query.answer()  # acknowledge button press
-
-    bank_name = query.data.split(":", 1)[1]
     try:
-        bank = Bank(bank_name)
-    except KeyError:
-        await query.message.reply_text("Unknown bank choice. Please resend the file.")
-        context.user_data.pop("pending_report", None)
-        return
-
-    logger.info(f"Selected bank {bank}")
-
-    report = context.user_data.pop("pending_report", None)
-    if report is None:
-        await query.message.reply_text(
-            "No pending file found. Please resend the document."
+        await bot.edit_message_text(
+            f"Ingest job {job.job_id}: {text}",
+            chat_id=job.chat_id,
+            message_id=job.message_id,
         )
-        return
+    except TelegramError as e:
+        logger.warning(f"Cannot update progress of job {job.job_id}: {e}")
+
+
+def _ingest_report(
+    job: IngestJob, progress: Callable[[str], None]
+) -> Tuple[UpdateResult, Optional[BytesIO]]:
+    result = update_database_from_file(
+        GROUPED_CATEGORIES_CSV_PATH,
+        DEFAULT_CSV_DELIMITER,
+        JOB_QUEUE.report_path(job.job_id),
+        sender=job.sender,
+        progress=progress,
+        ledger=LEDGER,
+    )
+    if result.duplicate:
+        return result, None
+    progress("render")
+    img_buf = render_current_db_statistics(
+        GROUPED_CATEGORIES_CSV_PATH,
+        DEFAULT_CSV_DELIMITER,
+        last_months=DEFAULT_SHOW_MONTHS,
+        fmt=STATISTICS_IMAGE_FORMAT,
+    )
+    return result, img_buf
 
-    sender = str(update.effective_user.first_name)
 
-    logger.info(f"Sender: {sender}")
+async def _run_ingest_job(bot: Bot, job: IngestJob) -> None:
+    loop = asyncio.get_running_loop()
 
+    def progress(stage: str) -> None:
+        # Called from the worker thread, the message is edited on the bot loop
+        job.stage = stage
+        JOB_QUEUE.save(job)
+        step = INGEST_STAGES.index(stage) + 1
+        edit = asyncio.run_coroutine_threadsafe(
+            _show_job_progress(bot, job, f"{stage} ({step}/{len(INGEST_STAGES)})"),
+            loop,
+        )
+        # Waiting keeps the edits in order, no stage overwrites the final text
+        try:
+            edit.result(timeout=PROGRESS_EDIT_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Progress of job {job.job_id} not shown: {e}")
+
+    job.status = JOB_RUNNING
+    JOB_QUEUE.save(job)
     try:
-        update_database(
-            GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER, report, bank, sender
+        result, img_buf = await asyncio.to_thread(_ingest_report, job, progress)
+    except UnicodeDecodeError:
+        JOB_QUEUE.finish(job, "encoding error")
+        await _show_job_progress(
+            bot, job, "failed. Please send the file encoded as UTF-8."
         )
+        return
     except Exception as e:
-        logger.error(f"{type(e)}: {e}")
-        await query.message.reply_text(f"Cannot process the last report. {e}")
+        logger.error(f"Ingest job {job.job_id} failed: {type(e)}: {e}")
+        JOB_QUEUE.finish(job, str(e))
+        await _show_job_progress(bot, job, f"cannot process the report. {e}")
         return
-    await report_current_db_statistics(update, context)
+
+    JOB_QUEUE.finish(job)
+    if result.duplicate:
+        await _show_job_progress(bot, job, "statement was already imported")
+        return
+    summary = f"{result.parsed} transactions parsed, {result.added} new"
+    if result.covered:
+        summary += f", {result.covered} covered by earlier statements"
+    if result.parse_report:
+        summary += (
+            f"\nSkipped {len(result.parse_report)} lines:\n"
+            f"{result.parse_report.format(limit=5)}"
+        )
+    await _show_job_progress(bot, job, "done")
+    await bot.send_photo(chat_id=job.chat_id, photo=img_buf)
+    await bot.send_message(chat_id=job.chat_id, text=summary)
+
+
+async def _ingest_worker(app: Application) -> None:
+    queue: asyncio.Queue = app.bot_data["ingest_queue"]
+    while True:
+        job_id = await queue.get()
+        job = None
+        try:
+            job = JOB_QUEUE.load(job_id)
+            if job is not None and not job.is_finished():
+                await _run_ingest_job(app.bot, job)
+            JOB_QUEUE.evict_abandoned(INGEST_UPLOAD_TTL_HOURS * 3600)
+        except Exception:
+            # One broken job must not stop the worker for the jobs behind it
+            logger.exception(f"Ingest job {job_id} failed")
+            if job is not None and not job.is_finished():
+                try:
+                    JOB_QUEUE.finish(job, "internal error")
+                except OSError:
+                    logger.exception(f"Cannot mark ingest job {job_id} failed")
+
+
+async def start_ingest_worker(app: Application) -> None:
+    JOB_QUEUE.prune(INGEST_JOB_RETENTION_DAYS)
+    JOB_QUEUE.evict_abandoned(INGEST_UPLOAD_TTL_HOURS * 3600)
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in JOB_QUEUE.pending():
+        logger.info(f"Resuming ingest job {job.job_id} ({job.status})")
+        queue.put_nowait(job.job_id)
+    app.bot_data["ingest_queue"] = queue
+    app.bot_data["ingest_worker"] = asyncio.create_task(_ingest_worker(app))
+
+
+async def stop_ingest_worker(app: Application) -> None:
+    worker = app.bot_data.pop("ingest_worker", None)
+    if worker is not None:
+        worker.cancel()
+
+
+async def job_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    job_id = (context.args or [""])[0]
+    job = JOB_QUEUE.load(job_id) if job_id.isalnum() else None
+    if job is None or job.chat_id != update.effective_chat.id:
+        await update.message.reply_text("Usage: /job <id> of one of your uploads")
+        return
+    text = f"Ingest job {job.job_id}: {job.status}"
+    if job.stage and not job.is_finished():
+        text += f", {job.stage}"
+    if job.error:
+        text += f"\n{job.error}"
+    await update.message.reply_text(text)
 
 
 async def last_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
     sender = (user.first_name or "").lower()
 
-    grouped = load_grouped_transactions_from_dbase(
-        GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER
+    query = TransactionQuery(
+        load_grouped_transactions_from_dbase(
+            GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER
+        )
     )
-
-    latest_by_bank: Dict[Bank, date] = {}
-    for cat in grouped.get_categories():
-        for tx in cat.get_transactions():
-            if tx.sender == sender:
-                b = tx.sender_bank
-                if b not in latest_by_bank or tx.date > latest_by_bank[b]:
-                    latest_by_bank[b] = tx.date
+    latest_by_bank = query.latest_date_by_bank(TransactionFilter(sender=sender))
 
     if not latest_by_bank:
         await update.message.reply_text("No transactions found for your account.")
@@ -177,17 +312,48 @@ async def last_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text("\n".join(lines))
 
 
+async def spent_this_month(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    start, end = month_bounds(date.today())
+    query = TransactionQuery(
+        load_grouped_transactions_from_dbase(
+            GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER, start, end
+        )
+    )
+    requested = " ".join(context.args or []).strip().lower()
+    names = {n.lower(): n for n in query.get_category_names()}
+    if requested not in names:
+        await update.message.reply_text(
+            "Usage: /spent <category>\nKnown categories: "
+            + ", ".join(query.get_category_names())
+        )
+        return
+
+    category = names[requested]
+    flt = TransactionFilter(categories=(category,), start=start, end=end)
+    await update.message.reply_text(
+        f"{category} in {start.strftime('%Y-%m')}: "
+        f"{abs(query.total(flt)):.2f} over {query.count(flt)} transactions"
+    )
+
+
 def main() -> None:
     token = os.environ.get("EXPENSE_TRACKER_TELEGRAM_BOT_TOKEN")
     if not token:
         raise RuntimeError("Missing EXPENSE_TRACKER_TELEGRAM_BOT_TOKEN in environment.")
 
-    app = Application.builder().token(token).build()
+    app = (
+        Application.builder()
+        .token(token)
+        .post_init(start_ingest_worker)
+        .post_stop(stop_ingest_worker)
+        .build()
+    )
     app.add_handler(CommandHandler("start", guarded(start)))
     app.add_handler(CommandHandler("show", guarded(report_current_db_statistics)))
     app.add_handler(CommandHandler("last", guarded(last_date)))
+    app.add_handler(CommandHandler("spent", guarded(spent_this_month)))
+    app.add_handler(CommandHandler("job", guarded(job_status)))
     app.add_handler(MessageHandler(filters.Document.ALL, guarded(handle_document)))
-    app.add_handler(CallbackQueryHandler(guarded(on_bank_chosen), pattern=r"^bank:"))
 
     logger.info("Bot starting with polling...")
     app.run_polling(close_loop=False)
@@ -0,0 +1,137 @@
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from GroupedTransactions import DateOrderedTransactions, GroupedTransactions
+from ReportParsers import Bank, Transaction
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TransactionFilter:
+    sender: Optional[str] = None
+    bank: Optional[Bank] = None
+    categories: Optional[Tuple[str, ...]] = None
+    start: Optional[date] = None
+    end: Optional[date] = None
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+
+    def matches(self, tx: Transaction) -> bool:
+        if self.sender is not None and tx.sender != self.sender.lower():
+            return False
+        if self.bank is not None and tx.sender_bank != self.bank:
+            return False
+        if self.min_amount is not None and tx.amount < self.min_amount:
+            return False
+        if self.max_amount is not None and tx.amount > self.max_amount:
+            return False
+        return True
+
+
+class TransactionQuery:
+    """
+    Answers filtered aggregations over GroupedTransactions. Sender filters
+    are resolved through the per-user index of GroupedTransactions, category
+    and date filters through per-category date indexes, so only the matching
+    slices are looked at by the remaining filters.
+    """
+
+    def __init__(self, grouped: GroupedTransactions):
+        self._grouped = grouped
+        self._by_category: Optional[Dict[str, DateOrderedTransactions]] = None
+
+    def _category_index(self) -> Dict[str, DateOrderedTransactions]:
+        if self._by_category is None:
+            self._by_category = {
+                cat.get_name(): DateOrderedTransactions(
+                    [(cat.get_name(), tx) for tx in cat.get_transactions()]
+                )
+                for cat in self._grouped.get_categories()
+            }
+        return self._by_category
+
+    def get_category_names(self) -> List[str]:
+        return sorted(c.get_name() for c in self._grouped.get_categories())
+
+    def _candidates(self, flt: TransactionFilter) -> Iterator[Tuple[str, Transaction]]:
+        known = self.get_category_names()
+        for name in flt.categories or ():
+            if name not in known:
+                raise KeyError(f"Unknown category: {name}")
+
+        if flt.sender is not None:
+            entries = self._grouped.get_user_transactions(
+                flt.sender, flt.bank, flt.start, flt.end
+            )
+            if flt.categories is None:
+                return iter(entries)
+            wanted = set(flt.categories)
+            return (e for e in entries if e[0] in wanted)
+
+        index = self._category_index()
+        names = known if flt.categories is None else flt.categories
+        return (e for name in names for e in index[name].between(flt.start, flt.end))
+
+    def _select(self, flt: TransactionFilter) -> Iterator[Tuple[str, Transaction]]:
+        return ((name, tx) for name, tx in self._candidates(flt) if flt.matches(tx))
+
+    def entries(self, flt: TransactionFilter) -> List[Tuple[str, Transaction]]:
+        return list(self._select(flt))
+
+    def select(self, flt: TransactionFilter) -> List[Transaction]:
+        return sorted((tx for _, tx in self._select(flt)), key=lambda tx: tx.date)
+
+    def count(self, flt: TransactionFilter) -> int:
+        return sum(1 for _ in self._select(flt))
+
+    def total(self, flt: TransactionFilter) -> float:
+        return sum(tx.amount for _, tx in self._select(flt))
+
+    def max_date(self, flt: TransactionFilter) -> Optional[date]:
+        return max((tx.date for _, tx in self._select(flt)), default=None)
+
+    def max_amount(self, flt: TransactionFilter) -> Optional[float]:
+        return max((tx.amount for _, tx in self._select(flt)), default=None)
+
+    def latest_date_by_bank(self, flt: TransactionFilter) -> Dict[Bank, date]:
+        if flt.sender is not None and flt == TransactionFilter(sender=flt.sender):
+            return self._grouped.get_latest_dates(flt.sender)
+        latest: Dict[Bank, date] = {}
+        for _, tx in self._select(flt):
+            b = tx.sender_bank
+            if b not in latest or tx.date > latest[b]:
+                latest[b] = tx.date
+        return latest
+
+    def monthly_totals(self, flt: TransactionFilter) -> Dict[str, float]:
+        totals: Dict[str, float] = defaultdict(float)
+        for _, tx in self._select(flt):
+            totals[tx.date.strftime("%Y-%m")] += tx.amount
+        return dict(totals)
+
+    def totals_by_category(self, flt: TransactionFilter) -> Dict[str, float]:
+        totals: Dict[str, float] = defaultdict(float)
+        for name, tx in self._select(flt):
+            totals[name] += tx.amount
+        return dict(totals)
+
+
+def month_bounds(day: date) -> Tuple[date, date]:
+    start = day.replace(day=1)
+    if start.month == 12:
+        next_month = start.replace(year=start.year + 1, month=1)
+    else:
+        next_month = start.replace(month=start.month + 1)
+    return start, date.fromordinal(next_month.toordinal() - 1)
+
+
+def month_window_start(day: date, months: int) -> date:
+    """First day of a window of the given number of months ending with day's month."""
+    if months < 1:
+        raise ValueError(f"Month window must be positive, got {months}")
+    index = day.year * 12 + day.month - 1 - (months - 1)
+    return date(index // 12, index % 12 + 1, 1)
@@ -0,0 +1,140 @@
+import heapq
+import logging
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from Categories import FlowDirection
+from GroupedTransactions import (
+    iter_db_rows,
+    load_lazy_grouped_transactions_from_dbase,
+)
+from ReportParsers import Transaction
+from RuleMatcher import IndexedMatcher, Rule, RuleSet, UNGROUPED_CATEGORY_NAME
+
+logger = logging.getLogger(__name__)
+
+_HAS_DIGIT = re.compile(r"\d")
+
+
+class ReceiverStats(NamedTuple):
+    receiver: str
+    count: int
+    total: float
+    examples: Tuple[str, ...]
+
+
+class CandidateRule(NamedTuple):
+    stats: ReceiverStats
+    pattern: re.Pattern
+    covered: int
+    conflicts: Dict[str, int]
+
+
+def normalize_receiver(receiver: str) -> str:
+    """
+    Drops trailing tokens holding digits, such as store numbers and terminal
+    ids, so 'albert heijn 1234' and 'albert heijn 5678' count as one receiver.
+    """
+    tokens = receiver.split()
+    while len(tokens) > 1 and _HAS_DIGIT.search(tokens[-1]):
+        tokens.pop()
+    return " ".join(tokens)
+
+
+def candidate_pattern(receiver: str) -> re.Pattern:
+    """An anchored pattern with a literal prefix, so the matcher indexes it."""
+    literal = " ".join(re.escape(token) for token in receiver.split())
+    return re.compile(rf"^{literal}(?:\s|$)")
+
+
+def top_receivers(
+    transactions: Iterable[Transaction], top: int, by_amount: bool = False
+) -> List[ReceiverStats]:
+    """The top receivers by transaction count, or by absolute total amount."""
+    counts: Counter = Counter()
+    totals: Dict[str, float] = {}
+    examples: Dict[str, Dict[str, None]] = {}
+    for tx in transactions:
+        receiver = normalize_receiver(tx.receiver)
+        counts[receiver] += 1
+        totals[receiver] = totals.get(receiver, 0.0) + tx.amount
+        seen = examples.setdefault(receiver, {})
+        if len(seen) < 3:
+            seen[tx.receiver] = None
+
+    if by_amount:
+        best = heapq.nlargest(top, totals, key=lambda r: abs(totals[r]))
+    else:
+        best = heapq.nlargest(top, counts, key=counts.__getitem__)
+    return [
+        ReceiverStats(r, counts[r], round(totals[r], 2), tuple(examples[r]))
+        for r in best
+    ]
+
+
+def check_candidates(
+    rows: Iterable[Tuple[str, Transaction]], stats: List[ReceiverStats]
+) -> List[CandidateRule]:
+    """
+    Runs every candidate pattern over the rows in one pass through an
+    IndexedMatcher. Each candidate is its own probe category, so a row is
+    tested only against the candidates its receiver can start with. Rows a
+    candidate matches outside Ungrouped are conflicts with existing rules.
+    """
+    patterns = [candidate_pattern(s.receiver) for s in stats]
+    probes = RuleSet()
+    for pattern in patterns:
+        probes.add_category(pattern.pattern, FlowDirection.EXPENSES)
+        probes.add_rule(Rule(pattern.pattern, pattern, None))
+    matcher = IndexedMatcher(probes)
+
+    covered: Counter = Counter()
+    conflicts: Dict[str, Counter] = {p.pattern: Counter() for p in patterns}
+    for name, tx in rows:
+        for probe in matcher.match(tx):
+            if name == UNGROUPED_CATEGORY_NAME:
+                covered[probe] += 1
+            else:
+                conflicts[probe][name] += 1
+    return [
+        CandidateRule(s, p, covered[p.pattern], dict(conflicts[p.pattern]))
+        for s, p in zip(stats, patterns)
+    ]
+
+
+def analyze_ungrouped(
+    db_path: str, db_delimiter: str, top: int = 20, by_amount: bool = False
+) -> List[CandidateRule]:
+    """
+    Ranks the receivers of Ungrouped and proposes an anchored rule for each.
+    Only Ungrouped rows are decoded for the ranking, then every candidate is
+    checked against the whole database in a single streaming pass.
+    """
+    lazy = load_lazy_grouped_transactions_from_dbase(db_path, db_delimiter)
+    ungrouped = lazy.get_transactions(UNGROUPED_CATEGORY_NAME)
+    logger.info(f"Ranking receivers of {len(ungrouped)} Ungrouped transactions")
+    stats = top_receivers(ungrouped, top, by_amount)
+    if not stats:
+        return []
+    return check_candidates(iter_db_rows(db_path, db_delimiter), stats)
+
+
+def format_candidates(candidates: List[CandidateRule]) -> str:
+    if not candidates:
+        return "No Ungrouped transactions"
+    lines = []
+    for i, c in enumerate(candidates, 1):
+        s = c.stats
+        lines.append(
+            f"{i:>3}. {s.receiver!r}: {s.count} transactions, {s.total:.2f} "
+            f"(e.g. {', '.join(repr(e) for e in s.examples)})"
+        )
+        conflicts = ", ".join(
+            f"{name} {count}" for name, count in sorted(c.conflicts.items())
+        )
+        lines.append(
+            f"     {c.pattern.pattern!r} covers {c.covered} Ungrouped; "
+            + (f"conflicts: {conflicts}" if conflicts else "no conflicts")
+        )
+    return "\n".join(lines)
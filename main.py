@@ -1,21 +1,55 @@
 import argparse
-from ReportParsers import Transaction, Bank, report_to_transactions, parse_filename
+from ReportParsers import (
+    Transaction,
+    Bank,
+    ParseReport,
+    parallel_report_to_transactions,
+    parse_sender_from_filename,
+    transactions_from_file,
+)
 from GroupedTransactions import (
+    is_compressed,
+    iter_db_rows,
+    shard_month,
     load_grouped_transactions_from_dbase,
+    load_lazy_grouped_transactions_from_dbase,
     GroupedTransactions,
     compare_categories,
 )
+from ExternalSort import ExternalSorter
+from RuleMatcher import RULE_BOOK, UNGROUPED_CATEGORY_NAME
+from TransactionTransformers import transaction_key
 from Categories import Ungrouped
 from CategoriesWriter import CsvCategoriesSaver
-from ExpenseVisualizer import plot_statistics
+from ExpenseVisualizer import plot_statistics, render_statistics
+from StatisticsReport import render_report
+from UngroupedAnalysis import analyze_ungrouped, format_candidates
 import logging
 import matplotlib.pyplot as plt
-from Constants import DEFAULT_CSV_DELIMITER, GROUPED_CATEGORIES_CSV_PATH
-from io import StringIO
+from StatementLedger import StatementLedger, file_digest, statement_spans
+from Snapshots import SnapshotManager
+from Constants import (
+    DEFAULT_CSV_DELIMITER,
+    GROUPED_CATEGORIES_CSV_PATH,
+    STATEMENT_LEDGER_PATH,
+)
+from io import BytesIO
 import os
+from datetime import date
+from TransactionQuery import month_window_start
 from matplotlib.figure import Figure
 import copy
-
+from collections import Counter
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Tuple,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -25,38 +59,300 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class UpdateResult(NamedTuple):
+    parsed: int
+    added: int
+    parse_report: ParseReport
+    # Rows skipped because earlier statements already covered their days
+    covered: int = 0
+    duplicate: bool = False
+
+
 def update_database(
-    db_path: str, db_delimiter: str, report: StringIO, bank: Bank, sender: str
-) -> None:
-    transactions: list[Transaction] = report_to_transactions(report, bank, sender)
+    db_path: str,
+    db_delimiter: str,
+    report: TextIO,
+    bank: Optional[Bank],
+    sender: str,
+    progress: Optional[Callable[[str], None]] = None,
+    ledger: Optional[StatementLedger] = None,
+    file_hash: Optional[str] = None,
+) -> UpdateResult:
+    """
+    Parses a report into the database. progress, when given, is called with
+    the name of each stage ("parse", "classify", "save") as it starts.
+    With a ledger only rows outside already covered days are classified,
+    and the report is recorded under file_hash once the database is saved.
+    A partitioned database only loads and saves the months of the new rows.
+    """
+    progress = progress or (lambda stage: None)
+    progress("parse")
+    parse_report = ParseReport()
+    transactions: list[Transaction] = parallel_report_to_transactions(
+        report, bank, sender, parse_report=parse_report
+    )
 
     logger.info(f"Number of transactions in update: {len(transactions)}")
+    if parse_report:
+        logger.warning(
+            f"Skipped {len(parse_report)} unparsable lines:\n{parse_report.format()}"
+        )
 
-    grouped = load_grouped_transactions_from_dbase(db_path, db_delimiter)
-    logger.info(f"Transaction groups after load:\n{grouped.format_category_counts()}")
+    fresh = transactions
+    if ledger is not None:
+        fresh = ledger.filter_uncovered(transactions)
+        if len(fresh) < len(transactions):
+            logger.info(
+                f"Skipping {len(transactions) - len(fresh)} transactions "
+                "covered by earlier statements"
+            )
+
+    added = 0
+    if fresh:
+        progress("classify")
+        start = end = None
+        if os.path.isdir(db_path):
+            start = min(tx.date for tx in fresh)
+            end = max(tx.date for tx in fresh)
+        grouped = load_grouped_transactions_from_dbase(
+            db_path, db_delimiter, start, end
+        )
+        logger.info(
+            f"Transaction groups after load:\n{grouped.format_category_counts()}"
+        )
 
-    grouped.add_transactions(transactions)
-    logger.info(f"Transaction groups after update:\n{grouped.format_category_counts()}")
+        added = grouped.add_transactions(fresh)
+        logger.info(
+            f"Transaction groups after update:\n{grouped.format_category_counts()}"
+        )
 
-    CsvCategoriesSaver().save(grouped=grouped, path=db_path, delimiter=db_delimiter)
+        progress("save")
+        CsvCategoriesSaver().save(grouped=grouped, path=db_path, delimiter=db_delimiter)
 
+    if ledger is not None and file_hash is not None:
+        ledger.record(file_hash, transactions)
+    return UpdateResult(
+        len(transactions), added, parse_report, len(transactions) - len(fresh)
+    )
 
-def update_database_from_file(db_path: str, db_delimiter: str, file_path: str) -> None:
+
+def update_database_from_file(
+    db_path: str,
+    db_delimiter: str,
+    file_path: str,
+    sender: Optional[str] = None,
+    progress: Optional[Callable[[str], None]] = None,
+    ledger: Optional[StatementLedger] = None,
+) -> UpdateResult:
+    """
+    Imports a statement file. The sender defaults to the one in the file
+    name. Files already recorded in the ledger are not parsed again.
+    """
     assert os.path.isfile(file_path)
-    filename = os.path.basename(file_path)
-    bank, sender = parse_filename(filename)
+    sender = sender or parse_sender_from_filename(file_path)
+    file_hash = None
+    if ledger is not None:
+        file_hash = file_digest(file_path)
+        entry = ledger.get(file_hash)
+        if entry is not None:
+            logger.info(f"{file_path} was already imported on {entry.recorded}")
+            return UpdateResult(0, 0, ParseReport(), duplicate=True)
     with open(file_path, "r", encoding="utf-8") as fin:
-        update_database(db_path, db_delimiter, StringIO(fin.read()), bank, sender)
+        return update_database(
+            db_path,
+            db_delimiter,
+            fin,
+            None,
+            sender,
+            progress=progress,
+            ledger=ledger,
+            file_hash=file_hash,
+        )
+
+
+def _drop_duplicates(
+    rows: Iterable[Tuple[str, tuple, int, Transaction]],
+) -> Iterator[Tuple[str, Transaction]]:
+    """
+    Takes (category, transaction key, sequence, transaction) rows in sorted
+    order and keeps the first added transaction of every category and key,
+    as Category.add_transaction does.
+    """
+    last = None
+    for name, key, _, tx in rows:
+        if (name, key) != last:
+            yield name, tx
+            last = (name, key)
+
+
+def archive_import(
+    db_path: str,
+    db_delimiter: str,
+    file_paths: List[str],
+    memory_budget: int,
+    ledger: Optional[StatementLedger] = None,
+) -> int:
+    """
+    Imports statements without keeping the history in memory. Existing rows
+    and newly classified ones go through an ExternalSorter limited to
+    memory_budget bytes, and the merged stream is written as the canonical
+    file. Rows are sorted by category and transaction key first, which makes
+    duplicates adjacent for dropping them, and then into canonical order.
+    Each sort gets half of memory_budget. A partitioned database is sorted
+    by month first so that each shard is written from one contiguous run.
+    Returns the number of rows written.
+    """
+    matcher = RULE_BOOK.get_matcher()
+    known = {c.get_name() for c in GroupedTransactions.list_all_categories()}
+    recorded = []
+    month_first = os.path.isdir(db_path)
+
+    def entry(name: str, tx: Transaction) -> tuple:
+        return (shard_month(tx.date), name, tx) if month_first else (name, tx)
+
+    by_key = ExternalSorter(memory_budget // 2)
+    with by_key, ExternalSorter(memory_budget // 2) as sorter:
+
+        def add(name: str, tx: Transaction) -> None:
+            by_key.add((name, transaction_key(tx), len(by_key), tx))
+
+        for name, tx in iter_db_rows(db_path, db_delimiter):
+            if name not in known:
+                raise ValueError(f"Unknown category: {name}")
+            add(name, tx)
+
+        for fp in file_paths:
+            file_hash = None
+            if ledger is not None:
+                file_hash = file_digest(fp)
+                if ledger.get(file_hash) is not None:
+                    logger.info(f"{fp} was already imported")
+                    continue
+            parse_report = ParseReport()
+            transactions = transactions_from_file(fp, parse_report)
+            if parse_report:
+                logger.warning(
+                    f"Skipped {len(parse_report)} unparsable lines in {fp}:\n"
+                    f"{parse_report.format()}"
+                )
+            fresh = transactions
+            if ledger is not None:
+                fresh = ledger.filter_uncovered(transactions)
+                recorded.append((file_hash, statement_spans(transactions)))
+            for tx in fresh:
+                names = matcher.match(tx)
+                if len(names) > 1:
+                    raise ValueError(
+                        f"Transaction matched multiple categories "
+                        f"({', '.join(sorted(names))}): {tx}"
+                    )
+                add(names[0] if names else UNGROUPED_CATEGORY_NAME, tx)
+            logger.info(f"Added {len(fresh)} transactions from {fp}")
+
+        for name, tx in _drop_duplicates(by_key.merged()):
+            sorter.add(entry(name, tx))
+        by_key.close()
+        rows = CsvCategoriesSaver().save_rows(
+            (row[-2:] for row in sorter.merged()), db_path, db_delimiter
+        )
+
+    for file_hash, spans in recorded:
+        ledger.record_spans(file_hash, spans)
+    return rows
+
+
+def _load_window(
+    db_path: str, db_delimiter: str, last_months: Optional[int]
+) -> GroupedTransactions:
+    """Loads only the months a last_months plot can show."""
+    start = None
+    if last_months is not None:
+        start = month_window_start(date.today(), last_months)
+    return load_grouped_transactions_from_dbase(db_path, db_delimiter, start)
+
+
+def partition_database(db_path: str, db_delimiter: str) -> int:
+    """
+    Converts a database file into a partitioned directory at the same path.
+    The file is kept next to it with a .monolithic suffix.
+    Returns the number of rows written.
+    """
+    if os.path.isdir(db_path):
+        raise ValueError(f"{db_path} is already partitioned")
+    monolithic_path = db_path + ".monolithic"
+    if os.path.exists(monolithic_path):
+        raise FileExistsError(f"{monolithic_path} is in the way")
+    os.replace(db_path, monolithic_path)
+    os.makedirs(db_path)
+    grouped = load_grouped_transactions_from_dbase(monolithic_path, db_delimiter)
+    CsvCategoriesSaver(compress=is_compressed(monolithic_path)).save(
+        grouped=grouped, path=db_path, delimiter=db_delimiter
+    )
+    return sum(len(c.get_transactions()) for c in grouped.get_categories())
+
+
+def set_database_compression(db_path: str, db_delimiter: str, compress: bool) -> None:
+    grouped = load_grouped_transactions_from_dbase(db_path, db_delimiter)
+    CsvCategoriesSaver(compress=compress).save(
+        grouped=grouped, path=db_path, delimiter=db_delimiter
+    )
 
 
-def plot_current_db_statistics(db_path: str, db_delimiter: str) -> Figure:
-    return plot_statistics(load_grouped_transactions_from_dbase(db_path, db_delimiter))
+def plot_current_db_statistics(
+    db_path: str,
+    db_delimiter: str,
+    sender: Optional[str] = None,
+    last_months: Optional[int] = None,
+) -> Figure:
+    return plot_statistics(
+        _load_window(db_path, db_delimiter, last_months),
+        sender=sender,
+        last_months=last_months,
+    )
+
+
+def write_current_db_report(
+    db_path: str,
+    db_delimiter: str,
+    out_dir: str,
+    last_months: Optional[int] = None,
+    fmt: str = "png",
+) -> List[str]:
+    return render_report(
+        _load_window(db_path, db_delimiter, last_months),
+        out_dir,
+        last_months=last_months,
+        fmt=fmt,
+    )
+
+
+def print_category_counts(db_path: str, db_delimiter: str) -> None:
+    lazy = load_lazy_grouped_transactions_from_dbase(db_path, db_delimiter)
+    print(lazy.format_category_counts())
+    date_range = lazy.get_date_range()
+    if date_range is not None:
+        print(f"Transactions from {date_range[0]} to {date_range[1]}")
+
+
+def render_current_db_statistics(
+    db_path: str,
+    db_delimiter: str,
+    sender: Optional[str] = None,
+    last_months: Optional[int] = None,
+    fmt: str = "png",
+) -> BytesIO:
+    return render_statistics(
+        _load_window(db_path, db_delimiter, last_months),
+        sender=sender,
+        last_months=last_months,
+        fmt=fmt,
+    )
 
 
 def validate_database_stays_the_same(db_path: str, db_delimiter: str) -> None:
     current = load_grouped_transactions_from_dbase(db_path, db_delimiter)
     logger.info(f"Transaction groups after load:\n{current.format_category_counts()}")
-    current.get_category(Ungrouped).clear()
+    current.clear_category(Ungrouped)
     logger.info(f"Dropping ungrouped transactions:\n{current.format_category_counts()}")
 
     all_trs = []
@@ -80,7 +376,7 @@ def process_ungrouped_transactions(db_path: str, db_delimiter: str) -> None:
 
     ungrouped_trs = copy.deepcopy(current.get_category(Ungrouped).get_transactions())
     logger.info(f"Number of ungrouped transactions before {len(ungrouped_trs)}")
-    current.get_category(Ungrouped).clear()
+    current.clear_category(Ungrouped)
 
     current.add_transactions(ungrouped_trs)
     logger.info(
@@ -108,6 +404,68 @@ def rewrite_groupings(db_path: str, db_delimiter: str) -> None:
     CsvCategoriesSaver().save(grouped=new_grouped, path=db_path, delimiter=db_delimiter)
 
 
+def preview_regrouping(
+    db_path: str, db_delimiter: str, ungrouped_only: bool = False, top: int = 10
+) -> str:
+    """
+    Classifies in memory what rewrite_groupings (or, with ungrouped_only,
+    process_ungrouped_transactions) would, and describes the difference
+    without writing anything.
+    """
+    current = load_grouped_transactions_from_dbase(db_path, db_delimiter)
+    if ungrouped_only:
+        source_categories = [current.get_category(Ungrouped)]
+    else:
+        source_categories = current.get_categories()
+    before = {
+        tx: c.get_name() for c in source_categories for tx in c.get_transactions()
+    }
+
+    conflicts: list = []
+    regrouped = GroupedTransactions()
+    regrouped.add_transactions(list(before), conflicts=conflicts)
+    after = {
+        tx: c.get_name()
+        for c in regrouped.get_categories()
+        for tx in c.get_transactions()
+    }
+
+    counts_before = Counter(
+        {c.get_name(): len(c.get_transactions()) for c in current.get_categories()}
+    )
+    counts_after = Counter(counts_before)
+    moves: Counter = Counter()
+    for tx, source in before.items():
+        destination = after.get(tx)
+        if destination == source:
+            continue
+        counts_after[source] -= 1
+        if destination is not None:
+            counts_after[destination] += 1
+            moves[(tx.receiver, source, destination)] += 1
+
+    names = sorted(set(counts_before) | set(counts_after))
+    name_w = max((len(n) for n in names), default=0)
+    lines = ["Category counts (before -> after):"]
+    for name in names:
+        b, a = counts_before[name], counts_after[name]
+        delta = f" ({a - b:+d})" if a != b else ""
+        lines.append(f"  {name:<{name_w}} {b:>6} -> {a:>6}{delta}")
+
+    lines.append(f"Moved transactions: {sum(moves.values())}")
+    for (receiver, source, destination), n in moves.most_common(top):
+        lines.append(f"  {n:>5} x {receiver!r}: {source} -> {destination}")
+
+    lines.append(f"Transactions matching multiple categories: {len(conflicts)}")
+    for tx, matched in conflicts[:top]:
+        lines.append(
+            f"  {tx.date} {tx.receiver!r} {tx.amount:.2f}: {', '.join(matched)}"
+        )
+    if len(conflicts) > top:
+        lines.append(f"  ... and {len(conflicts) - top} more")
+    return "\n".join(lines)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Process bank transaction file and group by category."
@@ -128,14 +486,91 @@ def main():
         action="store_true",
         help="Show current statistics without updating the DB.",
     )
+    mx.add_argument(
+        "--show-counts",
+        action="store_true",
+        help="Print transaction counts per category without decoding transactions.",
+    )
+    mx.add_argument(
+        "--partition-db",
+        action="store_true",
+        help="Convert the DB file into a directory of per-month shards.",
+    )
+    mx.add_argument(
+        "--compression",
+        choices=["gzip", "none"],
+        help="Rewrite the DB with or without gzip compression.",
+    )
+    mx.add_argument(
+        "--list-backups",
+        action="store_true",
+        help="List the kept generations of the DB.",
+    )
+    mx.add_argument(
+        "--restore-backup",
+        type=int,
+        metavar="GENERATION",
+        help="Restore a generation of the DB, 1 being the newest.",
+    )
+    mx.add_argument(
+        "--analyze-ungrouped",
+        action="store_true",
+        help="Rank Ungrouped receivers and propose rules checked for conflicts.",
+    )
     mx.add_argument(
         "--rewrite-groupings",
         action="store_true",
         help="Rewrite entire table with new groupings.",
     )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="With --rewrite-groupings or --process-ungrouped, only print what "
+        "would change.",
+    )
+    parser.add_argument(
+        "--report-dir",
+        type=str,
+        help="With --show-stats, render the report figures into this directory "
+        "instead of showing them",
+        required=False,
+    )
+    parser.add_argument(
+        "--report-format",
+        choices=["png", "html"],
+        default="png",
+        help="Write the report as PNG files or as a single HTML file",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=20,
+        help="Number of receivers for --analyze-ungrouped",
+    )
+    parser.add_argument(
+        "--by-amount",
+        action="store_true",
+        help="With --analyze-ungrouped, rank receivers by total amount, not count",
+    )
     parser.add_argument(
         "--path", type=str, help="Path to the transaction file(s)", required=False
     )
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=int,
+        help="Import --path with an external sort that keeps at most this many "
+        "MB of transactions in memory",
+        required=False,
+    )
+    parser.add_argument(
+        "--sender", type=str, help="Limit statistics to one sender", required=False
+    )
+    parser.add_argument(
+        "--last-months",
+        type=int,
+        help="Limit statistics to the last N months",
+        required=False,
+    )
     args = parser.parse_args()
 
     if args.validate_db:
@@ -144,17 +579,91 @@ def main():
         )
         return
 
+    if args.dry_run:
+        if not (args.rewrite_groupings or args.process_ungrouped):
+            parser.error(
+                "--dry-run requires --rewrite-groupings or --process-ungrouped"
+            )
+        print(
+            preview_regrouping(
+                GROUPED_CATEGORIES_CSV_PATH,
+                DEFAULT_CSV_DELIMITER,
+                ungrouped_only=args.process_ungrouped,
+            )
+        )
+        return
+
+    if args.analyze_ungrouped:
+        print(
+            format_candidates(
+                analyze_ungrouped(
+                    GROUPED_CATEGORIES_CSV_PATH,
+                    DEFAULT_CSV_DELIMITER,
+                    top=args.top,
+                    by_amount=args.by_amount,
+                )
+            )
+        )
+        return
+
     if args.process_ungrouped:
         process_ungrouped_transactions(
             GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER
         )
         return
 
+    if args.show_stats and args.report_dir:
+        for path in write_current_db_report(
+            GROUPED_CATEGORIES_CSV_PATH,
+            DEFAULT_CSV_DELIMITER,
+            args.report_dir,
+            last_months=args.last_months,
+            fmt=args.report_format,
+        ):
+            print(path)
+        return
+
     if args.show_stats:
-        plot_current_db_statistics(GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER)
+        plot_current_db_statistics(
+            GROUPED_CATEGORIES_CSV_PATH,
+            DEFAULT_CSV_DELIMITER,
+            sender=args.sender,
+            last_months=args.last_months,
+        )
         plt.show()
         return
 
+    if args.show_counts:
+        print_category_counts(GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER)
+        return
+
+    if args.partition_db:
+        partition_database(GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER)
+        print_category_counts(GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER)
+        return
+
+    if args.compression is not None:
+        set_database_compression(
+            GROUPED_CATEGORIES_CSV_PATH,
+            DEFAULT_CSV_DELIMITER,
+            compress=args.compression == "gzip",
+        )
+        return
+
+    if args.list_backups:
+        print(
+            "\n".join(SnapshotManager(GROUPED_CATEGORIES_CSV_PATH).describe())
+            or "No backups"
+        )
+        return
+
+    if args.restore_backup is not None:
+        SnapshotManager(GROUPED_CATEGORIES_CSV_PATH).restore(
+            args.restore_backup, StatementLedger(STATEMENT_LEDGER_PATH)
+        )
+        print_category_counts(GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER)
+        return
+
     if args.rewrite_groupings:
         rewrite_groupings(GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER)
         return
@@ -171,12 +680,30 @@ def main():
             if os.path.isfile(full_path):
                 file_paths.append(full_path)
 
+    ledger = StatementLedger(STATEMENT_LEDGER_PATH)
+    if args.memory_budget_mb is not None:
+        archive_import(
+            GROUPED_CATEGORIES_CSV_PATH,
+            DEFAULT_CSV_DELIMITER,
+            file_paths,
+            args.memory_budget_mb << 20,
+            ledger=ledger,
+        )
+        # Plotting would load the whole history, print the counts instead
+        print_category_counts(GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER)
+        return
+
     for fp in file_paths:
         update_database_from_file(
-            GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER, fp
+            GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER, fp, ledger=ledger
         )
 
-    plot_current_db_statistics(GROUPED_CATEGORIES_CSV_PATH, DEFAULT_CSV_DELIMITER)
+    plot_current_db_statistics(
+        GROUPED_CATEGORIES_CSV_PATH,
+        DEFAULT_CSV_DELIMITER,
+        sender=args.sender,
+        last_months=args.last_months,
+    )
     plt.show()
 
 